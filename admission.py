@@ -0,0 +1,176 @@
+"""
+Class for admitting incoming updates before they reach the handlers, and shedding them when the bot is overloaded.
+
+Every update passes through gate(), in a handler group of its own ahead of all the others. In order, an update is:
+- coalesced, i.e. dropped without a reply, if the same user sent the same thing to the same chat within the window,
+  such as a double-tapped button or a forwarded burst. The buttons of /pending are never coalesced, as pressing one
+  twice deselects a registrant or returns to a page.
+- shed if its user has run out of tokens, except for approval callbacks and the buttons of /pending, so that an IC
+  can click through a list of registrants
+- shed if the updates waiting behind it are over the limit, except for approval callbacks, which are shed only once
+  twice as many are waiting, so that approvals still go through while the bot is catching up
+- shed if the bot as a whole has run out of tokens, which approval callbacks skip too
+Users whose updates are shed are told to try again shortly, at most once per window each.
+
+Updates are handled one at a time, so the updates in flight are the ones waiting in the application's update queue,
+or in the worker's queue in webhook mode, see webhook._consume().
+
+Author: eliaise
+"""
+import logging
+import re
+import threading
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from ratelimit import TokenBucket
+from workers import sendWorker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER_RATE = 1           # updates per second per user
+DEFAULT_USER_BURST = 5
+DEFAULT_GLOBAL_RATE = 30        # updates per second across all users
+DEFAULT_GLOBAL_BURST = 60
+DEFAULT_WINDOW = 2              # seconds
+DEFAULT_BACKLOG = 100           # updates waiting to be handled
+MAX_USERS = 10000               # per user buckets kept before idle ones are dropped
+MAX_KEYS = 10000                # recent updates kept before expired ones are dropped
+
+PRIORITY = re.compile(r"^(Approve|Reject) [0-9]+$")
+SELECTION = re.compile(r"^Bulk ")
+MESSAGE = "The bot is busy. Please try again shortly."
+
+user_rate = DEFAULT_USER_RATE
+user_burst = DEFAULT_USER_BURST
+window = DEFAULT_WINDOW
+max_backlog = DEFAULT_BACKLOG
+global_bucket = TokenBucket(DEFAULT_GLOBAL_RATE, DEFAULT_GLOBAL_BURST)
+user_buckets = {}       # userId -> TokenBucket
+recent = {}             # (userId, chatId, content) -> time last seen
+notified = {}           # userId -> time last told to try again
+counts = {"admitted": 0, "coalesced": 0, "shed": 0}
+lock = threading.Lock()
+
+
+def configure(configs: dict) -> None:
+    """Sets the limits according to the configuration file"""
+    global user_rate, user_burst, window, max_backlog, global_bucket
+
+    user_rate = configs.get("admission_user_rate") or DEFAULT_USER_RATE
+    user_burst = configs.get("admission_user_burst") or DEFAULT_USER_BURST
+    window = configs.get("admission_window") or DEFAULT_WINDOW
+    max_backlog = configs.get("admission_backlog") or DEFAULT_BACKLOG
+    global_bucket = TokenBucket(configs.get("admission_global_rate") or DEFAULT_GLOBAL_RATE,
+                                configs.get("admission_global_burst") or DEFAULT_GLOBAL_BURST)
+    user_buckets.clear()
+    logger.info("Admitting %s updates per second per user and %s in all, with at most %s waiting.", user_rate,
+                global_bucket.rate, max_backlog)
+
+
+def stats() -> dict:
+    """Returns the number of updates admitted, coalesced and shed"""
+    with lock:
+        return dict(counts)
+
+
+def _count(outcome: str) -> None:
+    with lock:
+        counts[outcome] += 1
+
+
+def _content(update: Update):
+    """Returns what the update carries, to tell duplicates apart, or None if it cannot be compared"""
+    if update.callback_query:
+        return update.callback_query.data
+    message = update.effective_message
+    if message is None:
+        return None
+    if message.document:
+        return message.document.file_unique_id, message.caption
+    return message.text
+
+
+def _duplicate(user_id: int, chat_id: int, content, now: float) -> bool:
+    """Whether the same update was seen within the window, remembering this one if not"""
+    key = (user_id, chat_id, content)
+    with lock:
+        if key not in recent and len(recent) >= MAX_KEYS:
+            for expired in [key for key, seen in recent.items() if now - seen > window]:
+                del recent[expired]
+            for expired in [user for user, seen in notified.items() if now - seen > window]:
+                del notified[expired]
+
+        seen = recent.get(key)
+        if seen is not None and now - seen <= window:
+            return True
+        recent[key] = now
+        return False
+
+
+def _user_bucket(user_id: int) -> TokenBucket:
+    """Returns the bucket of the user, dropping the buckets of idle users if there are too many"""
+    with lock:
+        if user_id not in user_buckets and len(user_buckets) >= MAX_USERS:
+            for idle in [user for user, bucket in user_buckets.items() if bucket.full()]:
+                del user_buckets[idle]
+
+        if user_id not in user_buckets:
+            user_buckets[user_id] = TokenBucket(user_rate, user_burst)
+        return user_buckets[user_id]
+
+
+def _backlog(context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Returns the number of updates waiting to be handled"""
+    size = context.bot_data.get("backlog") or context.application.update_queue.qsize
+    try:
+        return size()
+    except NotImplementedError:
+        # multiprocessing queues cannot be sized on every platform
+        return 0
+
+
+async def _shed(update: Update, user_id: int, now: float) -> None:
+    """Tells the user to try again, unless they were told within the window, and stops the update"""
+    _count("shed")
+    if update.callback_query:
+        await update.callback_query.answer(MESSAGE)
+    elif update.effective_chat and (user_id is None or now - notified.get(user_id, -window) > window):
+        notified[user_id] = now
+        sendWorker.send(update.effective_chat.id, MESSAGE)
+    raise ApplicationHandlerStop
+
+
+async def gate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admits the update, or stops it from reaching the handlers"""
+    now = time.monotonic()
+    user_id = update.effective_user.id if update.effective_user else None
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    data = (update.callback_query.data or "") if update.callback_query else ""
+    priority = bool(PRIORITY.match(data))
+    selecting = bool(SELECTION.match(data))
+
+    if user_id is not None:
+        content = _content(update)
+        if content is not None and not selecting and _duplicate(user_id, chat_id, content, now):
+            _count("coalesced")
+            if update.callback_query:
+                await update.callback_query.answer()
+            raise ApplicationHandlerStop
+
+        if not priority and not selecting and not _user_bucket(user_id).try_take():
+            logger.debug("Shedding an update from user %s, who is over their rate.", user_id)
+            await _shed(update, user_id, now)
+
+    backlog = _backlog(context)
+    if backlog >= max_backlog * (2 if priority else 1):
+        logger.debug("Shedding an update from user %s, with %s updates waiting.", user_id, backlog)
+        await _shed(update, user_id, now)
+
+    if not priority and not global_bucket.try_take():
+        logger.debug("Shedding an update from user %s, as the bot is over its rate.", user_id)
+        await _shed(update, user_id, now)
+
+    _count("admitted")
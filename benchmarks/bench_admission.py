@@ -0,0 +1,93 @@
+"""
+Benchmark of admission control, with one user flooding the bot while everyone else sends a single /update.
+
+The updates are queued in the order they arrive and handled one at a time, as the application does, by a handler
+which takes --cost seconds. The flood of --flood updates arrives first, half of them repeats of the same message.
+The time until every other user has been answered is compared with and without the admission gate in front.
+
+Run from the repository root:
+    python -m benchmarks.bench_admission --flood 1000 --users 50 --cost 0.005
+
+Author: eliaise
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import admission
+from telegram.ext import ApplicationHandlerStop
+from workers import sendWorker
+
+SPAMMER_ID = 1
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeMessage:
+    def __init__(self, text: str):
+        self.text = text
+        self.document = None
+
+
+class FakeUpdate:
+    def __init__(self, user_id: int, text: str):
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = FakeUser(user_id)
+        self.effective_message = FakeMessage(text)
+        self.callback_query = None
+
+
+class FakeContext:
+    def __init__(self, queue: asyncio.Queue):
+        self.bot_data = {"backlog": queue.qsize}
+
+
+async def run(gated: bool, flood: int, users: int, cost: float) -> tuple:
+    """Handles the updates, returning the seconds until the other users were answered and how many were shed"""
+    admission.configure({})
+    queue = asyncio.Queue()
+    for number in range(flood):
+        queue.put_nowait(FakeUpdate(SPAMMER_ID, "/update WFH" if number % 2 else "/update {}".format(number)))
+    for user_id in range(SPAMMER_ID + 1, SPAMMER_ID + 1 + users):
+        queue.put_nowait(FakeUpdate(user_id, "/update Present"))
+
+    context = FakeContext(queue)
+    began = time.perf_counter()
+    answered = shed = 0
+    while answered + shed < users:
+        update = queue.get_nowait()
+        try:
+            if gated:
+                await admission.gate(update, context)
+        except ApplicationHandlerStop:
+            shed += update.effective_user.id != SPAMMER_ID
+            continue
+        await asyncio.sleep(cost)
+        answered += update.effective_user.id != SPAMMER_ID
+    return time.perf_counter() - began, shed
+
+
+def main() -> None:
+    """Parses the arguments and runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flood", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--cost", type=float, default=0.005, help="seconds to handle an update")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    sendWorker.send = lambda chat_id, text, **kwargs: None
+
+    for gated in (False, True):
+        elapsed, shed = asyncio.run(run(gated, args.flood, args.users, args.cost))
+        print("{:<16} other users answered after {:.2f}s, {} of them shed".format(
+            "admission gate" if gated else "no gate", elapsed, shed))
+    print("counters:", admission.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Benchmark for ggsheets.locate(), showing that the cost of a lookup does not grow with the size of the roster.
+
+Run from the repository root:
+    python -m benchmarks.bench_locate
+
+Author: eliaise
+"""
+import logging
+import random
+import timeit
+
+from connectors import ggsheets
+
+ROSTER_SIZES = [100, 1000, 10000, 100000]
+LOOKUPS = 100000
+
+
+def main() -> None:
+    """Times lookups of random users for rosters of increasing size."""
+    logging.disable(logging.INFO)
+
+    print("{:>10} {:>15}".format("users", "ns per lookup"))
+    for size in ROSTER_SIZES:
+        ggsheets.load([[user_id, "EXEC", "John Doe", "IT", None] for user_id in range(size)])
+        targets = [random.randrange(size) for _ in range(LOOKUPS)]
+
+        elapsed = timeit.timeit(lambda: [ggsheets.locate(user_id) for user_id in targets], number=1)
+        print("{:>10} {:>15.0f}".format(size, elapsed / LOOKUPS * 1e9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark for the users table before and after the schema migrations, on a table of 100k users.
+
+The query plan and the average time of each of the bot's lookups is printed for the unkeyed schema created by
+sql_commands.txt, and again once the table has its primary key and indexes.
+
+Run from the repository root against SQLite:
+    python -m benchmarks.bench_schema
+or against a scratch MySQL database, using the credentials in config/init.ini:
+    python -m benchmarks.bench_schema --mysql --database scratch
+
+Author: eliaise
+"""
+import argparse
+import logging
+import random
+import time
+
+import config
+from connectors import db, migrations
+
+USERS = 100000
+REPEATS = 200
+DEPARTMENTS = ["D{}".format(number) for number in range(500)]
+
+QUERIES = [
+    ("user by id", "SELECT name, accStatus FROM users WHERE userId = %s", lambda: (random.randrange(USERS),)),
+    ("department IC", "SELECT chatId FROM users WHERE department = %s AND role = 'IC'",
+     lambda: (random.choice(DEPARTMENTS),)),
+    ("active users", "SELECT userId FROM users WHERE accStatus = %s", lambda: (-1,)),
+]
+
+
+def explain(stmt: str, variables: tuple) -> list:
+    """Returns the query plan of the statement"""
+    prefix = "EXPLAIN QUERY PLAN" if db.dialect == "sqlite" else "EXPLAIN"
+    return db.execute("{} {}".format(prefix, stmt), variables, fetch=True)
+
+
+def report(title: str) -> None:
+    """Prints the plan and average time of every query"""
+    print("\n== {}".format(title))
+    for name, stmt, variables in QUERIES:
+        plan = explain(stmt, variables())
+
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            db.execute(stmt, variables(), fetch=True)
+        elapsed = (time.perf_counter() - start) / REPEATS
+
+        print("{:<15} {:>10.3f} ms  {}".format(name, elapsed * 1000, plan))
+
+
+def main() -> None:
+    """Fills an unkeyed users table, then reports on it before and after migrating"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mysql", action="store_true", help="use the MySQL server in config/init.ini")
+    parser.add_argument("--database", help="scratch MySQL database, its tables are dropped")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    if args.mysql:
+        if not args.database:
+            parser.error("--mysql needs a scratch --database")
+        params = config.read()
+        params["db_name"] = args.database
+        db.connect(params)
+        db.execute("DROP TABLE IF EXISTS users")
+        db.execute("DROP TABLE IF EXISTS schema_version")
+    else:
+        db.connect({"db_backend": "sqlite"})
+
+    migrations.migrate(target=1)
+
+    rows = [
+        (user_id, user_id, "User {}".format(user_id), "EXEC", random.choice(DEPARTMENTS),
+         "IC" if user_id % 200 == 0 else "User", 1 if user_id % 50 else 0)
+        for user_id in range(USERS)
+    ]
+    for start in range(0, USERS, 1000):
+        chunk = rows[start:start + 1000]
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+        db.execute("INSERT INTO users VALUES {}".format(placeholders), tuple(value for row in chunk for value in row))
+
+    report("unkeyed schema, {} users".format(USERS))
+    migrations.migrate()
+    report("migrated schema, {} users".format(USERS))
+
+
+if __name__ == "__main__":
+    main()
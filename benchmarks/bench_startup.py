@@ -0,0 +1,98 @@
+"""
+Cold-start benchmark, comparing connecting to the backends before taking updates, one after the other, with taking
+updates straight away and connecting to both in the background.
+
+Each run is a fresh process, so that the imports are cold. The database is the SQLite stand-in and Google Sheets is
+the fake client, with --db-latency and --sheets-latency seconds standing in for opening the MySQL pool and for the
+service account's first authentication. Both runs import mysql.connector and gspread, as a real deployment does,
+but the background run only does so while connecting.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --db-latency 1 --sheets-latency 2
+
+Author: eliaise
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+
+def run(mode: str, db_latency: float, sheets_latency: float) -> dict:
+    """Starts up in this process, returning the seconds taken to import, to take updates, and to be ready"""
+    began = time.perf_counter()
+    import asyncio
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+
+    import main
+    from connectors import db, fakes, ggsheets, sheetsapi
+    from workers import scheduler
+
+    if mode == "sequential":
+        # the backend libraries were imported along with the bot
+        import gspread
+        import mysql.connector
+    imported = time.perf_counter() - began
+
+    logging.disable(logging.WARNING)
+    main.configs = {"db_backend": "sqlite", "db_pool_size": 5, "requests_per_minute": 60}
+
+    def connect_database() -> None:
+        db.connector.pooling     # the MySQL driver is loaded to open the pool
+        time.sleep(db_latency)
+        main.connect_database(True)
+
+    def connect_sheets() -> None:
+        ggsheets.gspread.exceptions     # gspread is loaded to authenticate
+        time.sleep(sheets_latency)
+        sheetsapi.configure(main.configs)
+        ggsheets.connect(fakes.FakeClient())
+
+    if mode == "sequential":
+        connect_database()
+        connect_sheets()
+        accepting = ready = time.perf_counter() - began
+    else:
+        accepting = time.perf_counter() - began
+        scheduler.executor = ThreadPoolExecutor(max_workers=2)
+
+        async def warm_up() -> None:
+            await asyncio.gather(main.connect_backend("database", connect_database),
+                                 main.connect_backend("sheets", connect_sheets))
+
+        asyncio.run(warm_up())
+        ready = time.perf_counter() - began
+
+    return {"imports": imported, "accepting updates": accepting, "ready": ready}
+
+
+def main() -> None:
+    """Parses the arguments and runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-latency", type=float, default=1, help="seconds to open the database pool")
+    parser.add_argument("--sheets-latency", type=float, default=2, help="seconds to authenticate with Google")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--run", choices=("sequential", "background"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(args.run, args.db_latency, args.sheets_latency)))
+        return
+
+    print("{:<12} {:>10} {:>20} {:>10}".format("startup", "imports", "accepting updates", "ready"))
+    for mode in ("sequential", "background"):
+        results = []
+        for _ in range(args.runs):
+            command = [sys.executable, "-m", "benchmarks.bench_startup", "--run", mode,
+                       "--db-latency", str(args.db_latency), "--sheets-latency", str(args.sheets_latency)]
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        best = {key: min(result[key] for result in results) for key in results[0]}
+        print("{:<12} {:>9.2f}s {:>19.2f}s {:>9.2f}s".format(mode, best["imports"], best["accepting updates"],
+                                                             best["ready"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark for /stats over a year of attendance, against the SQLite stand-in.
+
+The ledger is filled with --days days of statuses for --users users, then a range is reported on three times: cold,
+again once its days are cached, and shifted so that it overlaps the cached days. The aggregation of the columnar
+table is also compared with counting the rows one at a time in Python.
+
+Run from the repository root:
+    python -m benchmarks.bench_stats --users 10000 --days 365
+
+Author: eliaise
+"""
+import argparse
+import logging
+import random
+import time
+from array import array
+from collections import Counter
+from datetime import date, timedelta
+
+from connectors import db, migrations, snapshot
+from workers import statsWorker
+
+DEPARTMENTS = ["IT", "HR", "Finance", "Operations", "Sales"]
+TITLES = ["EXEC", "MGR", "DIR", "ENG"]
+STATUSES = ["Present", "Present", "Present", "WFH", "Leave", "MC", "Course"]
+
+
+def fill(users: int, days: int) -> int:
+    """Fills the users table and the ledger, returning the number of statuses"""
+    db.run_many_sync("INSERT INTO users VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                     [(user_id, user_id, "User {}".format(user_id), TITLES[user_id % len(TITLES)],
+                       DEPARTMENTS[user_id % len(DEPARTMENTS)], "User", 1) for user_id in range(users)])
+
+    random.seed(0)
+    today = date.today()
+
+    def chunks():
+        for offset in range(days, 0, -1):
+            day = (today - timedelta(days=offset)).isoformat()
+            # about one in ten users gives no status on any day
+            yield [(user_id, day, random.choice(STATUSES)) for user_id in range(users) if random.random() < 0.9]
+
+    return db.run_chunks_sync("INSERT INTO attendance (userId, date, status) VALUES (%s, %s, %s)", chunks())
+
+
+def timed(label: str, start: date, end: date, department: str) -> None:
+    """Reports on the range, and prints the time taken"""
+    began = time.perf_counter()
+    result = statsWorker.report(start, end, department)
+    elapsed = time.perf_counter() - began
+    print("{:<28} {:>8.2f}s   {}".format(label, elapsed, statsWorker.rates(result["totals"])))
+
+
+def naive(user_ids: list, statuses: list, groups: dict) -> Counter:
+    """Counts the rows one at a time"""
+    counts = Counter()
+    for user_id, status in zip(user_ids, statuses):
+        category = statsWorker.PRESENT if snapshot.category(status) == snapshot.PRESENT else statsWorker.LEAVE
+        counts[(groups.get(user_id), category)] += 1
+    return counts
+
+
+def compare(users: int) -> None:
+    """Times the aggregation of one day's columns, vectorised and row by row"""
+    today = date.today()
+    roster = statsWorker.Roster([(user_id, DEPARTMENTS[user_id % len(DEPARTMENTS)], TITLES[user_id % len(TITLES)], 1,
+                                  today) for user_id in range(users)])
+    user_ids = list(range(users))
+    statuses = [random.choice(STATUSES) for _ in user_ids]
+    categories = statsWorker.Categories()
+
+    began = time.perf_counter()
+    for _ in range(100):
+        roster.aggregate(today, array("q", user_ids), array("b", map(categories.__getitem__, statuses)))
+    vectorised = (time.perf_counter() - began) / 100
+
+    began = time.perf_counter()
+    for _ in range(100):
+        naive(user_ids, statuses, roster.group_of)
+    row_by_row = (time.perf_counter() - began) / 100
+
+    print("one day of {} users:         vectorised {:.2f}ms, row by row {:.2f}ms".format(
+        users, vectorised * 1000, row_by_row * 1000))
+
+
+def main() -> None:
+    """Parses the arguments and runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--department", default="IT")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    db.connect({"db_backend": "sqlite", "db_pool_size": 1})
+    migrations.migrate()
+
+    began = time.perf_counter()
+    rows = fill(args.users, args.days)
+    print("filled {} statuses in {:.1f}s".format(rows, time.perf_counter() - began))
+
+    today = date.today()
+    first = today - timedelta(days=args.days)
+    window = timedelta(days=args.days * 5 // 6)
+    timed("cold, {} days".format(window.days), first, first + window, args.department)
+    timed("cached, {} days".format(window.days), first, first + window, args.department)
+    timed("overlapping, {} days".format(window.days), today - window - timedelta(days=1), today - timedelta(days=1),
+          args.department)
+    timed("cached, all departments", today - window - timedelta(days=1), today - timedelta(days=1), None)
+    compare(args.users)
+
+
+if __name__ == "__main__":
+    main()
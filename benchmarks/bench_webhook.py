@@ -0,0 +1,136 @@
+"""
+Benchmark comparing the update throughput of polling, where one process handles every update, with the webhook
+receiver spreading updates over worker processes by user id.
+
+Updates are processed by a stand-in handler which validates the text and then spends --work milliseconds on the CPU
+and --io milliseconds waiting, as a handler waiting on the database would. Polling is measured from the point the
+updates have been fetched, so it does not pay for the long-poll round trips it would make against Telegram.
+
+Run from the repository root:
+    python -m benchmarks.bench_webhook --updates 5000 --workers 4 --work 1
+
+Author: eliaise
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.client import HTTPConnection
+from re import search
+
+from telegram import Bot, Update, User
+from telegram.ext import Application, MessageHandler, filters
+
+import constants
+import webhook
+
+
+class OfflineBot(Bot):
+    """Bot which never contacts Telegram"""
+
+    async def get_me(self, *args, **kwargs) -> User:
+        return User(1, "bench", True)
+
+
+def burn(seconds: float) -> None:
+    """Keeps the CPU busy for the given time"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def handle(work: float, io: float, update: Update, context) -> None:
+    search(constants.REGEX_STATUS, update.message.text)
+    burn(work)
+    if io:
+        await asyncio.sleep(io)
+
+
+def build(work: float, io: float, index: int = 0, count: int = 1) -> Application:
+    """Builds an application with the stand-in handler"""
+    logging.disable(logging.WARNING)
+    application = Application.builder().bot(OfflineBot("1:bench")).build()
+    application.add_handler(MessageHandler(filters.TEXT, partial(handle, work, io)))
+    return application
+
+
+def updates(count: int, users: int) -> list:
+    """Returns the updates as Telegram would post them"""
+    return [json.dumps({
+        "update_id": number,
+        "message": {
+            "message_id": number,
+            "date": 0,
+            "chat": {"id": number % users + 1, "type": "private"},
+            "from": {"id": number % users + 1, "is_bot": False, "first_name": "User"},
+            "text": "Present"
+        }
+    }).encode() for number in range(count)]
+
+
+async def poll(bodies: list, work: float, io: float) -> float:
+    """Processes every update in this process, returning the time taken"""
+    application = build(work, io)
+    await application.initialize()
+
+    start = time.perf_counter()
+    for body in bodies:
+        await application.process_update(Update.de_json(json.loads(body), application.bot))
+    elapsed = time.perf_counter() - start
+
+    await application.shutdown()
+    return elapsed
+
+
+def post(port: int, bodies: list) -> None:
+    """Posts the updates to the receiver over one keep-alive connection"""
+    connection = HTTPConnection("127.0.0.1", port)
+    for body in bodies:
+        connection.request("POST", "/", body, {"Content-Type": "application/json"})
+        connection.getresponse().read()
+    connection.close()
+
+
+def push(bodies: list, work: float, io: float, workers: int, clients: int) -> float:
+    """Posts every update to the receiver, returning the time taken for the workers to process them all"""
+    started = webhook.start(workers, partial(build, work, io))
+    server = webhook.serve("127.0.0.1", 0, "/", None, started)
+    port = server.server_address[1]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(partial(post, port), [bodies[client::clients] for client in range(clients)]))
+    webhook.stop(started)
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    return elapsed
+
+
+def main() -> None:
+    """Parses the arguments and runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=8, help="connections Telegram posts updates over")
+    parser.add_argument("--work", type=float, default=1, help="milliseconds of CPU per update")
+    parser.add_argument("--io", type=float, default=0, help="milliseconds of waiting per update")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    bodies = updates(args.updates, args.users)
+    work, io = args.work / 1000, args.io / 1000
+
+    elapsed = asyncio.run(poll(bodies, work, io))
+    print("polling:             {:.2f}s, {:.0f} updates/s".format(elapsed, len(bodies) / elapsed))
+
+    elapsed = push(bodies, work, io, args.workers, args.clients)
+    print("webhook, {} workers: {:.2f}s, {:.0f} updates/s".format(args.workers, elapsed, len(bodies) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Load test which replays simulated users through the real handlers in main.py, against the in-process fakes of
+MySQL, Google Sheets and Telegram.
+
+Every user registers (/register, name, title, department), is approved by an admin, and sets their status with
+/update. The latency of every handler call is reported as p50/p95/p99, along with the throughput and the number of
+backend calls made per operation.
+
+Run from the repository root:
+    python -m benchmarks.loadtest --users 2000 --concurrency 100 --sheets-latency 0.05
+
+Author: eliaise
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from collections import defaultdict
+
+import main as bot
+from connectors import db, ggsheets, cache, fakes, migrations, sheetsapi
+from workers import sheetWorker, flushWorker, sendWorker
+
+ADMIN_ID = 1
+DEPARTMENTS = ["IT", "HR", "OPS", "FIN"]
+
+latencies = defaultdict(list)   # handler name -> seconds per call
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeMessage:
+    def __init__(self, user_id: int, text: str):
+        self.from_user = FakeUser(user_id)
+        self.chat = FakeChat(user_id)
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text: str, **kwargs) -> None:
+        fakes.count("telegram.reply_text")
+        self.replies.append(text)
+
+
+class FakeCallbackQuery:
+    def __init__(self, user_id: int, data: str, text: str):
+        self.data = data
+        self.message = FakeMessage(user_id, text)
+
+    async def answer(self) -> None:
+        fakes.count("telegram.answer")
+
+    async def edit_message_text(self, text: str, **kwargs) -> None:
+        fakes.count("telegram.edit_message_text")
+
+
+class FakeUpdate:
+    def __init__(self, message=None, callback_query=None):
+        self.message = message
+        self.callback_query = callback_query
+
+
+class FakeContext:
+    def __init__(self):
+        self.user_data = {}
+        self.args = []
+
+
+async def timed(handler, update, context):
+    """Calls the handler and records how long it took"""
+    start = time.perf_counter()
+    result = await handler(update, context)
+    latencies[handler.__name__].append(time.perf_counter() - start)
+    return result
+
+
+async def register(user_id: int) -> None:
+    """Goes through the registration conversation"""
+    context = FakeContext()
+    await timed(bot.handle_register, FakeUpdate(FakeMessage(user_id, "/register")), context)
+    await timed(bot.handle_name, FakeUpdate(FakeMessage(user_id, "John Doe")), context)
+    await timed(bot.handle_title, FakeUpdate(FakeMessage(user_id, "EXEC")), context)
+    department = DEPARTMENTS[user_id % len(DEPARTMENTS)]
+    await timed(bot.handle_department, FakeUpdate(FakeMessage(user_id, department)), context)
+
+
+async def approve(user_id: int) -> None:
+    """Presses the approve button of the registration request"""
+    query = FakeCallbackQuery(ADMIN_ID, "Approve {}".format(user_id), "EXEC John Doe is requesting to join.")
+    await timed(bot.handle_notify, FakeUpdate(callback_query=query), FakeContext())
+
+
+async def update_status(user_id: int) -> None:
+    """Sets the user's status for the day"""
+    context = FakeContext()
+    context.args = ["Present"]
+    await timed(bot.handle_update, FakeUpdate(FakeMessage(user_id, "/update Present")), context)
+
+
+async def run_phase(name: str, operation, user_ids: list, concurrency: int) -> None:
+    """Runs the operation for every user, with at most `concurrency` users at a time, and prints a report"""
+    fakes.reset()
+    latencies.clear()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run(user_id: int) -> None:
+        async with limit:
+            await operation(user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(user_id) for user_id in user_ids))
+    await sendWorker.queue.join()
+    if operation is update_status:
+        # include the cost of replicating the statuses to the sheet
+        flushWorker.replicate()
+    elapsed = time.perf_counter() - start
+
+    print("\n== {}: {} operations in {:.2f}s, {:.0f} operations/s".format(
+        name, len(user_ids), elapsed, len(user_ids) / elapsed))
+    print("{:<20} {:>8} {:>10} {:>10} {:>10}".format("handler", "calls", "p50 ms", "p95 ms", "p99 ms"))
+    for handler, samples in latencies.items():
+        centiles = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+        print("{:<20} {:>8} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            handler, len(samples), centiles[49] * 1000, centiles[94] * 1000, centiles[98] * 1000))
+    print("{:<30} {:>10}".format("backend call", "per op"))
+    for call, total in sorted(fakes.calls.items()):
+        print("{:<30} {:>10.3f}".format(call, total / len(user_ids)))
+
+
+async def run(args) -> None:
+    """Sets up the fakes and runs every phase of the load test"""
+    db.connect({"db_backend": "sqlite", "db_pool_size": args.pool_size})
+    db.pool.latency = args.db_latency
+    migrations.migrate()
+    db.run_insert_sync("INSERT INTO users VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                       (ADMIN_ID, ADMIN_ID, "Admin", "EXEC", "IT", "Admin", 1))
+
+    sendWorker.start(fakes.FakeBot(), {"global_rate": args.send_rate, "chat_rate": args.send_rate})
+    sheetsapi.configure({"requests_per_minute": args.sheets_rpm})
+    ggsheets.connect(fakes.FakeClient(latency=args.sheets_latency, error_rate=args.sheets_errors))
+    flushWorker.scheduled = True
+    flushWorker.size = float("inf")     # flushed once at the end of the update phase
+
+    user_ids = list(range(ADMIN_ID + 1, ADMIN_ID + 1 + args.users))
+    await run_phase("register", register, user_ids, args.concurrency)
+    await run_phase("approve", approve, user_ids, args.concurrency)
+
+    # the approved users are added to the sheet when it is next created
+    sheetWorker.create_sheet()
+    await run_phase("update", update_status, user_ids, args.concurrency)
+
+    await sendWorker.stop()
+    print("\ncache: {}".format(cache.stats()))
+    print("sheets: {}".format(sheetsapi.stats()))
+
+
+def main() -> None:
+    """Parses the arguments and runs the load test"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--db-latency", type=float, default=0.0, help="seconds added to every query")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="seconds added to every Sheets request")
+    parser.add_argument("--sheets-errors", type=float, default=0.0, help="chance of a Sheets quota error")
+    parser.add_argument("--sheets-rpm", type=int, default=60, help="Sheets requests per minute budget")
+    parser.add_argument("--send-rate", type=float, default=1000, help="outbound messages per second")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
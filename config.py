@@ -5,13 +5,8 @@ Author: eliaise
 """
 import logging
 from configparser import ConfigParser
+from datetime import datetime
 
-# Enable logging
-import constants
-
-logging.basicConfig(
-    format=constants.LOG_FORMAT, level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 CONFIG_FILE = "config/init.ini"
@@ -25,9 +20,51 @@ def read() -> dict:
 
     return {
         "bot_token": config["Telegram"]["BOT_TOKEN"],
+        "global_rate": config.getfloat("Telegram", "GLOBAL_RATE", fallback=30),
+        "chat_rate": config.getfloat("Telegram", "CHAT_RATE", fallback=1),
         "admin_email": config["Google"]["ADMIN_EMAIL"],
+        "file_path": config["Application"]["FILE_PATH"],
+        "worker_threads": config.getint("Application", "WORKER_THREADS", fallback=4),
+        "conversation_flush": config.getint("Application", "CONVERSATION_FLUSH", fallback=10),
+        "max_exports": config.getint("Application", "MAX_EXPORTS", fallback=2),
+        "flush_interval": config.getint("Google", "FLUSH_INTERVAL", fallback=5),
+        "flush_size": config.getint("Google", "FLUSH_SIZE", fallback=50),
+        "roster_interval": config.getint("Google", "ROSTER_INTERVAL", fallback=60),
+        "requests_per_minute": config.getint("Google", "REQUESTS_PER_MINUTE", fallback=60),
+        "provision_at": datetime.strptime(config.get("Google", "PROVISION_AT", fallback="22:00"), "%H:%M").time(),
+        "db_backend": config.get("MySQL", "BACKEND", fallback="mysql"),
         "db_host": config["MySQL"]["HOST"],
         "db_user": config["MySQL"]["USER"],
         "db_pass": config["MySQL"]["PASS"],
-        "db_name": config["MySQL"]["NAME"]
+        "db_name": config["MySQL"]["NAME"],
+        "db_pool_size": config.getint("MySQL", "POOL_SIZE", fallback=5),
+        "metrics_enabled": config.getboolean("Metrics", "ENABLED", fallback=False),
+        "metrics_host": config.get("Metrics", "HOST", fallback="127.0.0.1"),
+        "metrics_port": config.getint("Metrics", "PORT", fallback=9100),
+        "cache_size": config.getint("Cache", "SIZE", fallback=1000),
+        "cache_ttl": config.getint("Cache", "TTL", fallback=300),
+        "webhook_enabled": config.getboolean("Webhook", "ENABLED", fallback=False),
+        "webhook_url": config.get("Webhook", "URL", fallback=""),
+        "webhook_host": config.get("Webhook", "HOST", fallback="127.0.0.1"),
+        "webhook_port": config.getint("Webhook", "PORT", fallback=8443),
+        "webhook_secret": config.get("Webhook", "SECRET", fallback=""),
+        "webhook_workers": config.getint("Webhook", "WORKERS", fallback=4),
+        "webhook_refresh": config.getint("Webhook", "REFRESH", fallback=30),
+        "reminder_times": [datetime.strptime(value.strip(), "%H:%M").time()
+                           for value in config.get("Reminder", "TIMES", fallback="").split(",") if value.strip()],
+        "reminder_departments": [value.strip()
+                                 for value in config.get("Reminder", "DEPARTMENTS", fallback="").split(",")
+                                 if value.strip()],
+        "reminder_batch": config.getint("Reminder", "BATCH_SIZE", fallback=100),
+        "admission_user_rate": config.getfloat("Admission", "USER_RATE", fallback=1),
+        "admission_user_burst": config.getfloat("Admission", "USER_BURST", fallback=5),
+        "admission_global_rate": config.getfloat("Admission", "GLOBAL_RATE", fallback=30),
+        "admission_global_burst": config.getfloat("Admission", "GLOBAL_BURST", fallback=60),
+        "admission_window": config.getfloat("Admission", "WINDOW", fallback=2),
+        "admission_backlog": config.getint("Admission", "BACKLOG", fallback=100),
+        "log_level": config.get("Logging", "LEVEL", fallback="INFO"),
+        "log_query_sample": config.getfloat("Logging", "QUERY_SAMPLE_RATE", fallback=1),
+        "log_query_limit": config.getfloat("Logging", "QUERY_RATE_LIMIT", fallback=0),
+        "log_message_sample": config.getfloat("Logging", "MESSAGE_SAMPLE_RATE", fallback=1),
+        "log_message_limit": config.getfloat("Logging", "MESSAGE_RATE_LIMIT", fallback=0)
     }
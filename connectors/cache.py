@@ -0,0 +1,149 @@
+"""
+Class for caching user profiles and department contacts in memory.
+
+Entries are evicted in least recently used order once a cache is full, and expire after a time to live so that
+changes made outside the bot are eventually picked up. Writes made by the bot invalidate the affected entries.
+
+Author: eliaise
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from connectors import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 1000
+DEFAULT_TTL = 300       # seconds
+
+MISSING = object()      # returned by Cache.get when there is no usable entry
+
+USER_COLUMNS = ("userId", "chatId", "name", "title", "department", "role", "accStatus")
+
+
+class Cache:
+    """Bounded LRU cache whose entries expire after a time to live"""
+
+    def __init__(self, name: str, max_size: int = DEFAULT_SIZE, ttl: float = DEFAULT_TTL):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()    # key -> (expiry, value)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached value, or MISSING if there is no entry or it has expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return MISSING
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value) -> None:
+        """Caches the value, evicting the least recently used entry if the cache is full"""
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=MISSING) -> None:
+        """Drops the entry for the key, or every entry if no key is given"""
+        with self.lock:
+            if key is MISSING:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def purge(self) -> int:
+        """Drops expired entries. Returns the number of entries dropped."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, (expiry, _) in self.entries.items() if expiry < now]
+            for key in expired:
+                del self.entries[key]
+            return len(expired)
+
+    def stats(self) -> dict:
+        """Returns the counters used to tune the size of the cache"""
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+users = Cache("users")              # userId -> dict of the user's row, or None if not registered
+departments = Cache("departments")  # department -> (chatId, role) of the IC, or of an admin if there is no IC
+
+
+def configure(configs: dict) -> None:
+    """Sizes the caches according to the configuration file"""
+    for cache in (users, departments):
+        cache.max_size = configs.get("cache_size") or DEFAULT_SIZE
+        cache.ttl = configs.get("cache_ttl") or DEFAULT_TTL
+
+
+async def get_user(user_id: int):
+    """Returns the user's row as a dict, or None if the user has not registered"""
+    user = users.get(user_id)
+    if user is not MISSING:
+        return user
+
+    stmt = "SELECT {} FROM users WHERE userId = %s".format(", ".join(USER_COLUMNS))
+    result = await db.run_select(stmt, (user_id,))
+    if result is None:
+        # query failed, do not cache the failure
+        return None
+
+    user = dict(zip(USER_COLUMNS, result[0])) if result else None
+    users.put(user_id, user)
+    return user
+
+
+async def get_contact(department: str):
+    """
+    Returns the (chatId, role) of the department's IC, falling back to an admin.
+    None if there is no one to contact.
+    """
+    contact = departments.get(department)
+    if contact is not MISSING:
+        return contact
+
+    stmt = "SELECT chatId, role FROM users WHERE department = %s AND role = 'IC' LIMIT 1"
+    result = await db.run_select(stmt, (department,))
+    if not result:
+        stmt = "SELECT chatId, role FROM users WHERE role = 'Admin' LIMIT 1"
+        result = await db.run_select(stmt, None)
+        if not result:
+            return None
+
+    contact = tuple(result[0])
+    departments.put(department, contact)
+    return contact
+
+
+def purge() -> None:
+    """Drops expired entries from every cache"""
+    for cache in (users, departments):
+        purged = cache.purge()
+        if purged:
+            logger.info("Purged %s expired entries from the %s cache.", purged, cache.name)
+
+
+def stats() -> dict:
+    """Returns the counters of every cache"""
+    return {cache.name: cache.stats() for cache in (users, departments)}
@@ -0,0 +1,106 @@
+"""
+Class for persisting the state of users' conversations, so that a restart does not drop users halfway through one.
+
+Changes are held in memory and written to the conversation_state table in batches by flush(), which runs every few
+seconds and once more when the bot shuts down. A user's state is read back the first time they are heard from after
+a restart, rather than all at once on startup. Only the MAX_SEEN conversations heard from most recently are remembered
+as restored. A conversation forgotten is read back again the next time, which is harmless once its changes have been
+flushed, as the saved state is then the same as the one in memory.
+
+Author: eliaise
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from connectors import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 10   # seconds between flushes
+MAX_SEEN = 10000        # conversations remembered as restored
+
+SAVE = "INSERT INTO conversation_state (userId, chatId, state, data) VALUES (%s, %s, %s, %s) " \
+       "ON DUPLICATE KEY UPDATE state = VALUES(state), data = VALUES(data), updatedAt = CURRENT_TIMESTAMP"
+DELETE = "DELETE FROM conversation_state WHERE userId = %s AND chatId = %s"
+
+pending = {}        # (userId, chatId) -> (state, data) changed since the last flush, state None once ended
+lock = threading.Lock()
+seen = OrderedDict()    # (userId, chatId) whose state has been restored, or who had none, least recent first
+
+
+def _remember(key) -> None:
+    """Notes that the conversation has been restored, forgetting the least recent ones. Called with lock held."""
+    seen[key] = True
+    seen.move_to_end(key)
+    while len(seen) > MAX_SEEN:
+        seen.popitem(last=False)
+
+
+def save(user_id: int, chat_id: int, state, data: dict) -> None:
+    """Notes the conversation's new state. Only the latest state of each conversation is written."""
+    key = (user_id, chat_id)
+    with lock:
+        pending[key] = (state, data)
+        _remember(key)
+
+
+def end(user_id: int, chat_id: int) -> None:
+    """Notes that the conversation has ended"""
+    save(user_id, chat_id, None, None)
+
+
+def flush() -> int:
+    """
+    Writes the changed states in a batch, and deletes those of conversations which ended.
+
+    Returns the number of conversations written. Changes which could not be written are kept for the next flush.
+    """
+    global pending
+
+    with lock:
+        batch, pending = pending, {}
+    if not batch:
+        return 0
+
+    saved = [(user_id, chat_id, state, json.dumps(data)) for (user_id, chat_id), (state, data) in batch.items()
+             if state is not None]
+    ended = [key for key, (state, _) in batch.items() if state is None]
+
+    if (saved and not db.run_many_sync(SAVE, saved)) or (ended and not db.run_many_sync(DELETE, ended)):
+        with lock:
+            # keep the newer changes made while flushing
+            pending = {**batch, **pending}
+        return 0
+
+    logger.info("Saved %s conversations, and cleared %s.", len(saved), len(ended))
+    return len(batch)
+
+
+async def restore(user_id: int, chat_id: int):
+    """
+    Returns the (state, data) saved for the conversation, the first time the user is heard from.
+
+    None if the state has already been restored, or there was none.
+    """
+    key = (user_id, chat_id)
+    with lock:
+        # the state in memory is newer than the saved one until it has been flushed
+        if key in seen or key in pending:
+            _remember(key)
+            return None
+
+    stmt = "SELECT state, data FROM conversation_state WHERE userId = %s AND chatId = %s"
+    result = await db.run_select(stmt, key)
+    if result is None:
+        # query failed, try again on the next message
+        return None
+
+    with lock:
+        _remember(key)
+    if not result:
+        return None
+
+    state, data = result[0]
+    return state, json.loads(data) if data else {}
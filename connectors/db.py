@@ -1,47 +1,114 @@
 """
 Class for interacting with the database.
 
+Queries are served from a pool of connections. run_select, run_insert and run_update are coroutines which
+hand the blocking mysql.connector calls to a thread pool of the same size as the connection pool, so a slow
+query never stalls the event loop. The *_sync variants are thin wrappers for code running outside the loop.
+
 Author: eliaise
 """
+import asyncio
 import logging
-import mysql.connector
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import lazy
 
-# Enable logging
-import constants
+connector = lazy.load("mysql.connector")    # imported on first use
 
-logging.basicConfig(
-    format=constants.LOG_FORMAT, level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
-# mysql connection
-connection = None
+DEFAULT_POOL_SIZE = 5
+RECONNECT_ATTEMPTS = 3
+RECONNECT_DELAY = 1     # seconds between reconnection attempts
+
+# mysql connection pool
+pool = None
+dialect = "mysql"       # or "sqlite" when running against the in-process stand-in
+executor = None         # threads which run the queries, one per pooled connection
+slots = None            # guards the pool against being drained by sync callers
+observer = None         # called with (stmt, seconds, failed) after every statement, when metrics are enabled
+
+
+def _execute(stmt: str, variables, fetch: bool, many: bool = False):
+    """Run a statement on a pooled connection, timing it if metrics are enabled."""
+    if not observer:
+        return _execute_pooled(stmt, variables, fetch, many)
+
+    start = time.perf_counter()
+    failed = True
+    try:
+        result = _execute_pooled(stmt, variables, fetch, many)
+        failed = False
+        return result
+    finally:
+        observer(stmt, time.perf_counter() - start, failed)
+
+
+def _execute_pooled(stmt: str, variables, fetch: bool, many: bool = False):
+    """Run a statement on a pooled connection, reconnecting once if the connection was dropped."""
+    with slots:
+        connection = pool.get_connection()
+        try:
+            try:
+                return _run(connection, stmt, variables, fetch, many)
+            except (connector.errors.InterfaceError, connector.errors.OperationalError) as e:
+                logger.warning("Lost connection to the database (%s). Reconnecting.", e)
+                connection.reconnect(attempts=RECONNECT_ATTEMPTS, delay=RECONNECT_DELAY)
+                return _run(connection, stmt, variables, fetch, many)
+        finally:
+            connection.close()  # returns the connection to the pool
 
 
-def run_select(stmt: str, variables: tuple) -> list:
+def _run(connection, stmt: str, variables, fetch: bool, many: bool = False):
+    """Run a statement on the given connection. With many, the statement is run once for each row of variables."""
+    cursor = connection.cursor()
+    try:
+        if many:
+            cursor.executemany(stmt, variables)
+        else:
+            cursor.execute(stmt, variables)
+        if fetch:
+            return cursor.fetchall()
+        connection.commit()
+        return True
+    finally:
+        cursor.close()
+
+
+def execute(stmt: str, variables: tuple = None, fetch: bool = False):
+    """Run a statement, raising any error. Returns the rows if fetch is set."""
+    logger.info("Statement sent to database: %s", stmt)
+    return _execute(stmt, variables, fetch)
+
+
+async def _execute_async(stmt: str, variables, fetch: bool, many: bool = False):
+    """Run a statement in the query thread pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _execute, stmt, variables, fetch, many)
+
+
+async def run_select(stmt: str, variables: tuple) -> list:
     """Run a select statement."""
-    logger.info("SELECT query sent to database: {}".format(stmt))
+    logger.info("SELECT query sent to database: %s", stmt)
 
     result = None
 
     try:
-        with connection.cursor() as cursor:
-            cursor.execute(stmt, variables)
-            result = cursor.fetchall()
+        result = await _execute_async(stmt, variables, True)
     except Exception as e:
         logger.exception(e)
 
     return result
 
 
-def run_insert(stmt: str, variables: tuple) -> bool:
+async def run_insert(stmt: str, variables: tuple) -> bool:
     """Run an insert statement"""
-    logger.info("INSERT query sent to database: {}".format(stmt))
+    logger.info("INSERT query sent to database: %s", stmt)
 
     try:
-        with connection.cursor() as cursor:
-            cursor.execute(stmt, variables)
-            connection.commit()
+        await _execute_async(stmt, variables, False)
     except Exception as e:
         logger.exception(e)
         return False
@@ -49,14 +116,12 @@ def run_insert(stmt: str, variables: tuple) -> bool:
     return True
 
 
-def run_update(stmt: str, variables: tuple) -> bool:
+async def run_update(stmt: str, variables: tuple) -> bool:
     """Run an update statement"""
-    logger.info("UPDATE query sent to database: {}".format(stmt))
+    logger.info("UPDATE query sent to database: %s", stmt)
 
     try:
-        with connection.cursor() as cursor:
-            cursor.execute(stmt, variables)
-            connection.commit()
+        await _execute_async(stmt, variables, False)
     except Exception as e:
         logger.exception(e)
         return False
@@ -64,18 +129,183 @@ def run_update(stmt: str, variables: tuple) -> bool:
     return True
 
 
-def connect(params: dict) -> None:
-    """Connect to the database"""
-    global connection
+async def run_many(stmt: str, rows: list) -> bool:
+    """Run an insert or update statement once for each row, in a single round trip where the driver allows"""
+    logger.info("Batch of %s queries sent to database: %s", len(rows), stmt)
 
     try:
-        connection = mysql.connector.connect(
+        await _execute_async(stmt, rows, False, True)
+    except Exception as e:
+        logger.exception(e)
+        return False
+
+    return True
+
+
+def run_select_sync(stmt: str, variables: tuple) -> list:
+    """Run a select statement from outside the event loop."""
+    logger.info("SELECT query sent to database: %s", stmt)
+
+    result = None
+
+    try:
+        result = _execute(stmt, variables, True)
+    except Exception as e:
+        logger.exception(e)
+
+    return result
+
+
+def run_insert_sync(stmt: str, variables: tuple) -> bool:
+    """Run an insert statement from outside the event loop."""
+    logger.info("INSERT query sent to database: %s", stmt)
+
+    try:
+        _execute(stmt, variables, False)
+    except Exception as e:
+        logger.exception(e)
+        return False
+
+    return True
+
+
+def run_update_sync(stmt: str, variables: tuple) -> bool:
+    """Run an update statement from outside the event loop."""
+    logger.info("UPDATE query sent to database: %s", stmt)
+
+    try:
+        _execute(stmt, variables, False)
+    except Exception as e:
+        logger.exception(e)
+        return False
+
+    return True
+
+
+def run_many_sync(stmt: str, rows: list) -> bool:
+    """Run an insert or update statement once for each row, from outside the event loop."""
+    logger.info("Batch of %s queries sent to database: %s", len(rows), stmt)
+
+    try:
+        _execute(stmt, rows, False, True)
+    except Exception as e:
+        logger.exception(e)
+        return False
+
+    return True
+
+
+def stream_sync(stmt: str, variables: tuple, size: int = 1000):
+    """
+    Run a select statement from outside the event loop, yielding the rows in chunks of up to size rows as they are
+    read, so that a large result is never held in memory at once. Errors are raised.
+
+    The connection is held until the generator is exhausted or closed.
+    """
+    logger.info("Streaming SELECT query sent to database: %s", stmt)
+
+    start = time.perf_counter()
+    failed = True
+    with slots:
+        connection = pool.get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(stmt, variables)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+            failed = False
+        except GeneratorExit:
+            # closed by the caller before the end
+            failed = False
+            raise
+        finally:
+            try:
+                # a result which was not read to the end would block the connection's next statement
+                while cursor.fetchmany(size):
+                    pass
+            finally:
+                cursor.close()
+                connection.close()
+                if observer:
+                    observer(stmt, time.perf_counter() - start, failed)
+
+
+def run_chunks_sync(stmt: str, chunks) -> int:
+    """
+    Run an insert or update statement once for each row of each chunk, all in one transaction, from outside the
+    event loop. The chunks may be a generator, and are consumed as they are sent.
+
+    Returns the number of rows. On error the transaction is rolled back, and the error is raised.
+    """
+    logger.info("Chunked batch sent to database: %s", stmt)
+
+    start = time.perf_counter()
+    failed = True
+    with slots:
+        connection = pool.get_connection()
+        try:
+            connection.start_transaction()
+            cursor = connection.cursor()
+            try:
+                rows = 0
+                for chunk in chunks:
+                    cursor.executemany(stmt, chunk)
+                    rows += len(chunk)
+                connection.commit()
+                failed = False
+                return rows
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+            if observer:
+                observer(stmt, time.perf_counter() - start, failed)
+
+
+def connect(params: dict) -> None:
+    """Create the database connection pool, exiting if the database cannot be reached"""
+    try:
+        create_pool(params)
+    except Exception as e:
+        logger.exception(e)
+        exit(1)
+
+
+def create_pool(params: dict) -> None:
+    """Create the database connection pool, raising any error"""
+    global pool, executor, slots, dialect
+
+    pool_size = params.get("db_pool_size") or DEFAULT_POOL_SIZE
+
+    if params.get("db_backend") == "sqlite":
+        # in-process stand-in for running without a MySQL server
+        from connectors import fakes
+        pool = fakes.SQLitePool(params.get("db_name") or ":memory:")
+        dialect = "sqlite"
+    else:
+        pool = connector.pooling.MySQLConnectionPool(
+            pool_name="attendance",
+            pool_size=pool_size,
+            pool_reset_session=True,
             host=params.get("db_host"),
             user=params.get("db_user"),
             password=params.get("db_pass"),
             database=params.get("db_name"),
             autocommit=True
         )
-    except Exception as e:
-        logger.exception(e)
-        exit(1)
+
+    executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
+    slots = threading.BoundedSemaphore(pool_size)
+    logger.info("Connected to the database with a pool of %s connections.", pool_size)
+
+
+def close() -> None:
+    """Stop the query threads. Pooled connections are closed when the process exits."""
+    if executor:
+        executor.shutdown(wait=True)
@@ -0,0 +1,272 @@
+"""
+In-process stand-ins for MySQL, Google Sheets and the Telegram bot, for running the bot without its backends.
+
+SQLitePool takes the place of the mysql.connector pool and runs the same statements on SQLite. The schema is
+created by connectors/migrations.py, as it is for MySQL.
+FakeClient takes the place of the gspread client, records every call, and can add latency or quota errors.
+FakeBot takes the place of the telegram Bot and records the messages sent.
+
+Every fake counts the calls made to it in `calls`, so that the cost of an operation can be measured.
+
+Author: eliaise
+"""
+import itertools
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import gspread
+import requests
+
+calls = Counter()       # backend call -> number of calls
+calls_lock = threading.Lock()
+
+
+def count(call: str) -> None:
+    """Counts a call to a backend"""
+    with calls_lock:
+        calls[call] += 1
+
+
+def reset() -> None:
+    """Resets the call counters"""
+    with calls_lock:
+        calls.clear()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# MySQL
+
+def translate(stmt: str) -> str:
+    """Rewrites a MySQL statement into its SQLite equivalent"""
+    stmt = stmt.replace("%s", "?")
+    stmt = stmt.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+    return re.sub(r"VALUES\((\w+)\)", r"excluded.\1", stmt)
+
+
+class SQLiteCursor:
+    """Cursor which accepts MySQL statements"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.db.cursor()
+
+    def execute(self, stmt: str, variables=None) -> None:
+        count("db.{}".format(stmt.split(None, 1)[0].upper()))
+        with self.connection.lock:
+            self.cursor.execute(translate(stmt), variables or ())
+            self.rows = self.cursor.fetchall()
+        self.fetched = 0
+
+    def executemany(self, stmt: str, rows) -> None:
+        count("db.{}".format(stmt.split(None, 1)[0].upper()))
+        with self.connection.lock:
+            self.cursor.executemany(translate(stmt), rows)
+            self.rows = []
+
+    def fetchall(self) -> list:
+        return self.rows
+
+    def fetchmany(self, size: int = 1) -> list:
+        rows = self.rows[self.fetched:self.fetched + size]
+        self.fetched += len(rows)
+        return rows
+
+    def close(self) -> None:
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    """Pooled connection backed by a single SQLite database"""
+
+    def __init__(self, db, lock):
+        self.db = db
+        self.lock = lock
+
+    def cursor(self) -> SQLiteCursor:
+        return SQLiteCursor(self)
+
+    def start_transaction(self) -> None:
+        # the connection is shared, so statements from other threads join the transaction
+        with self.lock:
+            self.db.execute("BEGIN")
+
+    def commit(self) -> None:
+        with self.lock:
+            self.db.commit()
+
+    def rollback(self) -> None:
+        with self.lock:
+            self.db.rollback()
+
+    def reconnect(self, attempts=1, delay=0) -> None:
+        pass
+
+    def close(self) -> None:
+        # the connection is shared, closing only returns it to the pool
+        pass
+
+
+class SQLitePool:
+    """Stand-in for mysql.connector's MySQLConnectionPool"""
+
+    def __init__(self, path: str = ":memory:", latency: float = 0):
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.latency = latency
+
+    def get_connection(self) -> SQLiteConnection:
+        if self.latency:
+            time.sleep(self.latency)
+        return SQLiteConnection(self.db, self.lock)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Google Sheets
+
+def api_error(status: int, message: str) -> gspread.exceptions.APIError:
+    """Creates the error gspread raises for a failed request"""
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"error": {"code": status, "message": message}}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+class FakeClient:
+    """Stand-in for the gspread client"""
+
+    def __init__(self, latency: float = 0, error_rate: float = 0):
+        self.latency = latency          # seconds added to every request
+        self.error_rate = error_rate    # chance of a request failing with a quota error
+        self.books = {}
+
+    def request(self, call: str) -> None:
+        """Simulates a request to the Sheets API"""
+        count("sheets.{}".format(call))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            count("sheets.quota_error")
+            raise api_error(429, "Quota exceeded")
+
+    def open(self, title: str):
+        self.request("open")
+        if title not in self.books:
+            raise gspread.exceptions.SpreadsheetNotFound
+        return self.books[title]
+
+    def create(self, title: str):
+        self.request("create")
+        self.books[title] = FakeSpreadsheet(self, title)
+        return self.books[title]
+
+
+class FakeSpreadsheet:
+    """Stand-in for gspread's Spreadsheet"""
+
+    def __init__(self, client: FakeClient, title: str):
+        self.client = client
+        self.title = title
+        self.sheets = {}
+
+    def share(self, value, perm_type, role) -> None:
+        self.client.request("share")
+
+    def worksheet(self, title: str):
+        self.client.request("worksheet")
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title: str, rows: int, cols: int):
+        self.client.request("add_worksheet")
+        self.sheets[title] = FakeWorksheet(self.client, title, rows)
+        return self.sheets[title]
+
+    def duplicate_sheet(self, source_sheet_id, insert_sheet_index=None, new_sheet_id=None, new_sheet_name=None):
+        self.client.request("duplicate_sheet")
+        source = next(sheet for sheet in self.sheets.values() if sheet.id == source_sheet_id)
+        copy = FakeWorksheet(self.client, new_sheet_name, source.row_count)
+        copy.rows = [list(row) for row in source.rows]
+        self.sheets[new_sheet_name] = copy
+        return copy
+
+
+class FakeWorksheet:
+    """Stand-in for gspread's Worksheet, holding its cells in a list of rows"""
+
+    ids = itertools.count()
+
+    def __init__(self, client: FakeClient, title: str, row_count: int = 1000):
+        self.id = next(FakeWorksheet.ids)
+        self.client = client
+        self.title = title
+        self.rows = []
+        self.row_count = row_count
+
+    def get_all_values(self) -> list:
+        self.client.request("get_all_values")
+        return [list(row) for row in self.rows]
+
+    def append_row(self, values: list) -> None:
+        self.client.request("append_row")
+        self.rows.append(list(values))
+
+    def append_rows(self, values: list) -> None:
+        self.client.request("append_rows")
+        self.rows.extend(list(row) for row in values)
+
+    def update_acell(self, label: str, value) -> None:
+        self.client.request("update_acell")
+        self._set(label, value)
+
+    def resize(self, rows: int) -> None:
+        self.client.request("resize")
+        self.row_count = rows
+
+    def update(self, label: str, values: list) -> None:
+        self.client.request("update")
+        self._write(label, values)
+
+    def batch_update(self, data: list) -> None:
+        self.client.request("batch_update")
+        for change in data:
+            self._write(change["range"], change["values"])
+
+    def _write(self, label: str, values: list) -> None:
+        """Writes the block of values from the cell, leaving the cells given None as they were, as Sheets does"""
+        column, row = re.match(r"([A-Z]+)(\d+)", label).groups()
+        for row_offset, values_row in enumerate(values):
+            for column_offset, value in enumerate(values_row):
+                if value is not None:
+                    self._set("{}{}".format(chr(ord(column) + column_offset), int(row) + row_offset), value)
+        while self.rows and not any(self.rows[-1]):
+            self.rows.pop()
+
+    def _set(self, label: str, value) -> None:
+        column, row = re.match(r"([A-Z]+)(\d+)", label).groups()
+        row = int(row) - 1
+        column = ord(column) - ord("A")
+        while len(self.rows) <= row:
+            self.rows.append([])
+        while len(self.rows[row]) <= column:
+            self.rows[row].append("")
+        self.rows[row][column] = value
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Telegram
+
+class FakeBot:
+    """Stand-in for the telegram Bot"""
+
+    def __init__(self, token=None):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs) -> None:
+        count("telegram.send_message")
+        self.sent.append((chat_id, text))
@@ -3,24 +3,144 @@ Class for creating and updating Google spreadsheets
 
 Author: eliaise
 """
-import gspread
 import logging
+import threading
 from datetime import date
 
 import config
 import constants
+import lazy
+import logconfig
+from connectors import sheetsapi
+
+gspread = lazy.load("gspread")     # imported on first use
 
-# Enable logging
-logging.basicConfig(
-    format=constants.LOG_FORMAT, level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 connection = None
-book_name = None    # the target book name, updated daily
-sheet_name = None   # the target sheet name, updated monthly
+book_name = None    # the target book name, updated monthly
+sheet_name = None   # the target sheet name, updated daily
+
+book = None         # cached handle of the target book
+sheet = None        # cached handle of the target sheet
+handle_lock = threading.Lock()
+
+AUTH_ERRORS = (401, 403)
+
+values = None       # values in all rows and columns, excluding the header
+index = {}          # sheet row of each user, keyed by user id
+rows_lock = threading.Lock()    # held while writing rows, so that rows are not moved while a status is written
+
+templates = {}      # book name -> (template worksheet, rows last laid out in it)
+prepared = {}       # day -> (book, sheet, rows) of the worksheets built ahead of their day
+
+
+def load(rows: list) -> None:
+    """Replaces the cached values, and rebuilds the index of users to rows"""
+    global values, index
+
+    logger.info("Indexing %s rows.", len(rows))
+    values = list(rows)
+    index = {str(row[0]): row_num for row_num, row in enumerate(values, start=2)}  # row 1 is the header
+
+
+def _clear() -> None:
+    """Forgets the cached values and index"""
+    global values, index
+
+    values = None
+    index = {}
+
+
+def read() -> list:
+    """Returns the rows in the current worksheet, excluding the header"""
+    return with_sheet(lambda target: sheetsapi.call("get_all_values", target.get_all_values)[1:])
+
+
+def invalidate() -> None:
+    """Drops the cached book and sheet handles"""
+    global book, sheet
+
+    with handle_lock:
+        book = None
+        sheet = None
+
+
+def _rollover() -> None:
+    """
+    Moves to the new day's worksheet once the day has changed. Called with handle_lock held.
+
+    The index is switched along with the handles, so that a status is never written to a row of the previous day's
+    worksheet. If the day's worksheet was built ahead of time, the switch makes no requests.
+    """
+    global book_name, sheet_name, book, sheet
+
+    today = date.today()
+    current_book = today.strftime(constants.WORKBOOK_NAME)
+    current_sheet = today.strftime(constants.SHEET_NAME)
+    if (current_book, current_sheet) == (book_name, sheet_name):
+        return
+
+    logger.info("Rolling over to worksheet %s of %s.", current_sheet, current_book)
+    if today in prepared:
+        book, sheet, rows = prepared.pop(today)
+        load(rows)
+    else:
+        if current_book != book_name:
+            book = None
+        sheet = None
+        if book_name is not None:
+            # the index is of the previous day's worksheet, nothing can be located until the new one is loaded
+            _clear()
+    book_name = current_book
+    sheet_name = current_sheet
+
+
+def rollover() -> None:
+    """Moves to the new day's worksheet, if the day has changed"""
+    with handle_lock:
+        _rollover()
+
+
+def get_sheet():
+    """
+    Returns the handle of today's worksheet, opening it only if it is not cached.
+
+    The cached handles are dropped when the book or sheet name rolls over, unless the new day's worksheet was built
+    ahead of time.
+    """
+    global book, sheet
+
+    with handle_lock:
+        _rollover()
+
+        if not book:
+            book = sheetsapi.call("open", connection.open, book_name, coalesce=True)
+        if not sheet:
+            sheet = sheetsapi.call("worksheet", book.worksheet, sheet_name, coalesce=True)
+
+        return sheet
+
+
+def with_sheet(action):
+    """
+    Runs the action on today's worksheet and returns its result.
+
+    If the cached handles have gone stale or the credentials have expired, the handles are refreshed and the action
+    is tried one more time.
+    """
+    try:
+        return action(get_sheet())
+    except (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound):
+        logger.info("Cached worksheet is no longer valid. Refreshing.")
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code not in AUTH_ERRORS:
+            raise
+        logger.info("Google rejected the credentials. Reconnecting.")
+        connect()
 
-values = None       # values in all rows and columns
+    invalidate()
+    return action(get_sheet())
 
 
 def locate(user_id: str) -> str:
@@ -31,17 +151,16 @@ def locate(user_id: str) -> str:
         empty: values is empty
         not_found: unable to find the requested user
     """
-    logger.info("Locating user {}".format(user_id))
-    row_num = 2         # first row is index 1, which is the header
+    logger.info("Locating user %s", user_id)
 
+    rollover()
     if not values:
         logger.info("Values is empty.")
         return "empty"
 
-    for row in values:
-        if row[0] == user_id:
-            return "D{}".format(row_num)
-        row += 1
+    row_num = index.get(str(user_id))
+    if row_num:
+        return "{}{}".format(constants.STATUS_COLUMN, row_num)
 
     # user is not found
     # possible 2 reasons:
@@ -50,107 +169,263 @@ def locate(user_id: str) -> str:
     return "not_found"
 
 
-def create(admin=None) -> int:
-    """
-    Create a new spreadsheet
-
-    Returns the following status code:
-        0: created
-        1: worksheet exists
-    """
-    logger.info("Creating new spreadsheet.")
-    global book_name, sheet_name, connection
-
-    book_name = date.today().strftime(constants.WORKBOOK_NAME)
-    sheet_name = date.today().strftime(constants.SHEET_NAME)
-    book = None
-    sheet = None
-
-    # check if workbook exists
+def open_book(name: str, admin=None):
+    """Returns the handle of the named workbook, creating it and sharing it with the admin if it does not exist"""
     try:
-        book = connection.open(book_name)
+        workbook = sheetsapi.call("open", connection.open, name, coalesce=True)
         logger.info("Workbook found.")
     except gspread.exceptions.SpreadsheetNotFound:
         logger.info("Workbook not found. Creating and sharing with admin")
-        book = connection.create(book_name)
+        workbook = sheetsapi.call("create", connection.create, name)
 
         # share workbook with admin to allow viewing
-        if not admin:
-            logger.info("Sharing with admin at {}".format(admin))
-            book.share(admin, perm_type='user', role='writer')
+        if admin:
+            logger.info("Sharing with admin at %s", admin)
+            sheetsapi.call("share", workbook.share, admin, perm_type='user', role='writer')
 
-    # check if worksheet exists
-    try:
-        sheet = book.worksheet(sheet_name)
-        logger.info("Worksheet found.")
+    return workbook
 
-        return 1
-    except gspread.exceptions.WorksheetNotFound:
-        logger.info("Worksheet not found. Creating.")
-        sheet = book.add_worksheet(title=constants.SHEET_NAME, rows=constants.SHEET_ROWS, cols=constants.SHEET_COLUMNS)
 
-    return 0
+def _template(workbook, name: str, rows: list):
+    """
+    Returns the workbook's template worksheet with the rows laid out in it.
+
+    The rows last laid out are remembered, so the template is only written when the roster has changed.
+    """
+    template, laid_out = templates.get(name, (None, None))
+    if template is None:
+        try:
+            template = sheetsapi.call("worksheet", workbook.worksheet, constants.TEMPLATE_NAME, coalesce=True)
+        except gspread.exceptions.WorksheetNotFound:
+            template = sheetsapi.call("add_worksheet", workbook.add_worksheet, title=constants.TEMPLATE_NAME,
+                                      rows=max(constants.SHEET_ROWS, len(rows) + 1), cols=constants.SHEET_COLUMNS)
+
+    if rows != laid_out:
+        logger.info("Laying out %s rows in the template of %s.", len(rows), name)
+        _lay_out(template, rows)
+    templates[name] = (template, rows)
+    return template
+
+
+def provision(day: date, roster, admin=None) -> bool:
+    """
+    Builds the day's worksheet ahead of time, and holds it ready to be switched to when the day begins.
 
+    roster is called for the sorted rows of the roster, which are laid out in the workbook's template and the template
+    duplicated as the day's worksheet. If the day's worksheet already exists, its rows are read instead.
 
-def update_cell(cell: str, cell_data: str) -> None:
-    """Updates the target cell"""
-    logger.info("Updating cell {}".format(cell))
-    global book_name, sheet_name, connection
-    book = None
-    sheet = None
+    Returns whether the worksheet was built.
+    """
+    target_book = day.strftime(constants.WORKBOOK_NAME)
+    target_sheet = day.strftime(constants.SHEET_NAME)
+    workbook = open_book(target_book, admin)
 
     try:
-        book = connection.open(book_name)
-        sheet = book.worksheet(sheet_name)
-    except gspread.exceptions.SpreadsheetNotFound:
-        logger.error("Workbook not found.")
-        exit(1)
+        worksheet = sheetsapi.call("worksheet", workbook.worksheet, target_sheet, coalesce=True)
+        logger.info("Worksheet %s already exists.", target_sheet)
+        rows = sheetsapi.call("get_all_values", worksheet.get_all_values)[1:]
+        built = False
     except gspread.exceptions.WorksheetNotFound:
-        logger.error("Worksheet not found.")
-        exit(1)
+        rows = [list(row) for row in roster()]
+        template = _template(workbook, target_book, rows)
+        logger.info("Building worksheet %s of %s from the template.", target_sheet, target_book)
+        worksheet = sheetsapi.call("duplicate_sheet", workbook.duplicate_sheet, template.id,
+                                   insert_sheet_index=0, new_sheet_name=target_sheet)
+        built = True
 
-    sheet.update_acell(cell, cell_data)
+    with handle_lock:
+        # worksheets of days which have passed are never switched to
+        for past in [past for past in prepared if past < date.today()]:
+            del prepared[past]
+        prepared[day] = (workbook, worksheet, rows)
+    return built
 
 
-def append(data: list) -> None:
-    """Appends data to the workbook"""
-    logger.info("Appending rows to workbook.")
-    global book_name, connection
-    book = None
-    sheet = None
+def activate() -> None:
+    """Switches to the worksheet built for today straight away, rather than on the next request"""
+    global book_name
 
-    try:
-        book = connection.open(book_name)
-    except gspread.exceptions.SpreadsheetNotFound:
-        # Recoverable.
-        logger.info("Workbook not found. Creating.")
-        create()
+    with handle_lock:
+        # force the switch, even if today's worksheet was already active
+        book_name = None
+        _rollover()
+
+
+def write_statuses(changes: list) -> list:
+    """
+    Writes the (user_id, status) changes to today's worksheet in a single batch update.
+
+    Returns the user ids whose status was written. Users without a row in the worksheet are skipped.
+    Errors are raised to the caller, which keeps the changes for the next attempt.
+    """
+    with rows_lock:
+        data = []
+        written = []
+        for user_id, status in changes:
+            cell = locate(user_id)
+            if cell in ("empty", "not_found"):
+                logger.info("Skipping status of user %s, no row was found.", user_id)
+                continue
+            data.append({"range": cell, "values": [[status]]})
+            written.append((user_id, status))
+
+        if not data:
+            return []
+
+        logger.info("Writing %s status changes.", len(data))
+        with_sheet(lambda target: sheetsapi.call("batch_update", target.batch_update, data))
+
+        # keep the cached rows current, as they are copied when rows are moved
+        for user_id, status in written:
+            row_num = index[str(user_id)]
+            values[row_num - 2] = list(values[row_num - 2][:4]) + [status]
+        return [user_id for user_id, _ in written]
+
+
+def sync_roster(users: dict) -> dict:
+    """
+    Brings the rows of the given users on today's worksheet in line with the database, in a single batch update.
+
+    users maps each user id to their row (userId, title, name, department, status), or to None if they should not be
+    on the worksheet. Users missing from the worksheet are appended with the status given, and users whose details
+    changed are rewritten in place, keeping the status already on the worksheet.
+    The row of a user who is removed is filled by moving the last row into it, and the last row is cleared, so that
+    the worksheet never has gaps. Only the rows of the given users, and the rows moved, are read or written.
+
+    Returns the number of rows appended, updated and removed, with the ids of the users appended or updated, or None
+    if today's worksheet is not loaded yet.
+    Errors are raised to the caller, in which case the cached rows are left as they were.
+    """
+    global values, index
+
+    with rows_lock:
+        rollover()
+        if values is None:
+            return None
+
+        current = sheet_name
+        # changes are made to copies, which replace the cached rows once the worksheet has been written
+        new_values = list(values)
+        new_index = dict(index)
+        changed = {}    # sheet row -> its new values, blank if cleared
+        counts = {"appended": 0, "updated": 0, "removed": 0}
+        synced = []     # users appended or updated
+
+        for user_id, row in users.items():
+            key = str(user_id)
+            row_num = new_index.get(key)
+            if row is None:
+                if row_num is None:
+                    continue
+                last = len(new_values) + 1
+                if row_num != last:
+                    moved = new_values[last - 2]
+                    new_values[row_num - 2] = moved
+                    new_index[str(moved[0])] = row_num
+                    changed[row_num] = moved
+                new_values.pop()
+                del new_index[key]
+                changed[last] = [""] * constants.SHEET_COLUMNS
+                counts["removed"] += 1
+            elif row_num is None:
+                new_values.append(list(row[:5]))
+                row_num = len(new_values) + 1
+                new_index[key] = row_num
+                changed[row_num] = new_values[-1]
+                counts["appended"] += 1
+                synced.append(user_id)
+            else:
+                cached = new_values[row_num - 2]
+                if [str(value) for value in cached[1:4]] == [str(value) for value in row[1:4]]:
+                    continue
+                new_values[row_num - 2] = list(row[:4]) + list(cached[4:5])
+                changed[row_num] = new_values[row_num - 2]
+                counts["updated"] += 1
+                synced.append(user_id)
+
+        if not changed:
+            return counts, synced
+
+        last_column = chr(ord("A") + constants.SHEET_COLUMNS - 1)
+        data = [{"range": "A{0}:{1}{0}".format(row_num, last_column),
+                 "values": [[("" if value is None else value) for value in row]
+                            + [""] * (constants.SHEET_COLUMNS - len(row))]}
+                for row_num, row in sorted(changed.items())]
+
+        def write(target) -> None:
+            rows = max(changed)
+            if rows > target.row_count:
+                sheetsapi.call("resize", target.resize, rows=rows)
+            sheetsapi.call("batch_update", target.batch_update, data)
+
+        logger.info("Syncing the roster: %s.", counts)
+        with_sheet(write)
+
+        if sheet_name == current:
+            values = new_values
+            index = new_index
+        return counts, synced
+
+
+def _lay_out(worksheet, rows: list) -> None:
+    """Replaces the contents of the worksheet with the header and the given rows, in a single bulk write"""
+    # blank out whatever was below the new rows, so that a single write replaces everything
+    # Sheets leaves cells given None as they were, so statuses not given yet are written as blanks
+    data = [constants.SHEET_HEADER] + [["" if value is None else value for value in row] for row in rows]
+    if len(data) > worksheet.row_count:
+        sheetsapi.call("resize", worksheet.resize, rows=len(data))
+    blank = [""] * constants.SHEET_COLUMNS
+    data += [blank] * (worksheet.row_count - len(data))
+    sheetsapi.call("update", worksheet.update, "A1", data)
+
+
+def rewrite(day: date, rows: list) -> None:
+    """
+    Replaces the contents of the day's worksheet with the header and the given rows, in a single bulk write.
+
+    The worksheet, and its workbook, are created if they do not exist.
+    """
+    logger.info("Rewriting the worksheet of %s with %s rows.", day, len(rows))
+    target_book = day.strftime(constants.WORKBOOK_NAME)
+    target_sheet = day.strftime(constants.SHEET_NAME)
+    workbook = open_book(target_book)
 
     try:
-        sheet = book.worksheet(constants.SHEET_NAME)
+        worksheet = sheetsapi.call("worksheet", workbook.worksheet, target_sheet, coalesce=True)
     except gspread.exceptions.WorksheetNotFound:
-        # shouldn't happen, but doesn't hurt to be safe
-        logger.error("Worksheet not found.")
-        exit(1)
+        worksheet = sheetsapi.call("add_worksheet", workbook.add_worksheet, title=target_sheet,
+                                   rows=max(constants.SHEET_ROWS, len(rows) + 1), cols=constants.SHEET_COLUMNS)
+
+    _lay_out(worksheet, rows)
 
-    sheet.append_rows(values=data)
+    if (target_book, target_sheet) == (book_name, sheet_name):
+        invalidate()
+    with handle_lock:
+        if day in prepared:
+            prepared[day] = (workbook, worksheet, [list(row) for row in rows])
 
 
-def connect() -> None:
-    """Connects to the Google Drive via the service account"""
+def connect(client=None) -> None:
+    """Connects to the Google Drive via the service account, unless a client is given"""
     logger.info("Connecting to the Google Drive.")
     global connection
 
+    if client:
+        connection = client
+        return
+
     connection = gspread.service_account(filename='../config/gg_creds.json')
 
 
 def main() -> None:
     """Main method for testing"""
 
+    logconfig.setup()
     connect()
-    create()
-    append([["EXEC", "John Doe", "IT", "Present"]])
-    update_cell("D1", "Leave")
+    provision(date.today(), lambda: [[11112222, "EXEC", "John Doe", "IT", None]])
+    activate()
+    sync_roster({11113333: (11113333, "EXEC", "Jane Doe", "IT", "Present")})
+    write_statuses([(11112222, "Leave")])
 
 
 if __name__ == "__main__":
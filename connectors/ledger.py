@@ -0,0 +1,55 @@
+"""
+Class for the attendance ledger, the system of record for every user's status on every day.
+
+The daily worksheet is a replica of the ledger. Every change bumps the row's version, and the version last written
+to the sheet is kept in syncedVersion, so rows which still need to be written can always be found again.
+
+Author: eliaise
+"""
+import logging
+from datetime import date
+
+import constants
+from connectors import db
+
+logger = logging.getLogger(__name__)
+
+RECORD = "INSERT INTO attendance (userId, date, status) VALUES (%s, %s, %s) " \
+         "ON DUPLICATE KEY UPDATE status = VALUES(status), version = version + 1, updatedAt = CURRENT_TIMESTAMP"
+MARK_SYNCED = "UPDATE attendance SET syncedVersion = %s WHERE userId = %s AND date = %s AND syncedVersion < %s"
+
+
+async def record(user_id: int, status: str, day: date = None) -> bool:
+    """Records the user's status for the day, today by default"""
+    day = day or date.today()
+    return await db.run_insert(RECORD, (user_id, day.isoformat(), status))
+
+
+def unsynced(day: date) -> list:
+    """Returns the (userId, status, version) of the day's rows which have changed since they were last synced"""
+    stmt = "SELECT userId, status, version FROM attendance WHERE date = %s AND version > syncedVersion"
+    return db.run_select_sync(stmt, (day.isoformat(),))
+
+
+def mark_synced(day: date, rows: list) -> bool:
+    """Records that the (userId, version) rows of the day have been written to the sheet"""
+    if not rows:
+        return True
+    return db.run_many_sync(MARK_SYNCED, [(version, user_id, day.isoformat(), version) for user_id, version in rows])
+
+
+def roster(day: date) -> list:
+    """
+    Returns the day's roster as sheet rows (userId, title, name, department, status), sorted by department, title and
+    name. The roster is the users on the worksheet, as synced by the roster worker.
+    """
+    stmt = "SELECT u.userId, u.title, u.name, u.department, a.status FROM users u " \
+           "LEFT JOIN attendance a ON a.userId = u.userId AND a.date = %s " \
+           "WHERE u." + constants.ON_ROSTER + " ORDER BY u.department, u.title, u.name"
+    return db.run_select_sync(stmt, (day.isoformat(),))
+
+
+def versions(day: date) -> list:
+    """Returns the (userId, version) of every row of the day"""
+    stmt = "SELECT userId, version FROM attendance WHERE date = %s"
+    return db.run_select_sync(stmt, (day.isoformat(),))
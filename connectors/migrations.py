@@ -0,0 +1,175 @@
+"""
+Class for migrating the database schema.
+
+Every migration has a version number, and the versions applied are recorded in the schema_version table so that
+each migration runs once. Migrations check the state of the schema before changing it, so a migration interrupted
+halfway can safely be run again.
+
+Author: eliaise
+"""
+import logging
+
+from connectors import db
+
+logger = logging.getLogger(__name__)
+
+USER_COLUMNS = """(
+    userId bigint NOT NULL,
+    chatId bigint,
+    name varchar(255),
+    title varchar(255),
+    department varchar(255),
+    role varchar(255),
+    accStatus int{}
+)"""
+
+
+def table_exists(table: str) -> bool:
+    """Whether the table exists"""
+    if db.dialect == "sqlite":
+        stmt = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s"
+    else:
+        stmt = "SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+    return bool(db.execute(stmt, (table,), fetch=True))
+
+
+def index_exists(table: str, name: str) -> bool:
+    """Whether the table has an index of the given name"""
+    if db.dialect == "sqlite":
+        stmt = "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s"
+    else:
+        stmt = "SELECT index_name FROM information_schema.statistics " \
+               "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s"
+    return bool(db.execute(stmt, (table, name), fetch=True))
+
+
+def has_primary_key(table: str) -> bool:
+    """Whether the table has a primary key"""
+    if db.dialect == "sqlite":
+        return any(column[5] for column in db.execute("PRAGMA table_info({})".format(table), fetch=True))
+    return index_exists(table, "PRIMARY")
+
+
+def create_index(table: str, name: str, columns: str) -> None:
+    """Creates the index if the table does not have it yet"""
+    if index_exists(table, name):
+        logger.info("Index %s already exists.", name)
+        return
+    db.execute("CREATE INDEX {} ON {} {}".format(name, table, columns))
+
+
+def create_users() -> None:
+    """Creates the users table, as it was created by sql_commands.txt"""
+    db.execute("CREATE TABLE IF NOT EXISTS users {}".format(USER_COLUMNS.format("")))
+
+
+def key_users() -> None:
+    """
+    Adds a primary key on userId.
+
+    The rows are copied into a new keyed table, keeping the first row of any user who registered more than once,
+    and the new table is swapped in.
+    """
+    if has_primary_key("users"):
+        logger.info("Table users already has a primary key.")
+        return
+
+    ignore = "OR IGNORE" if db.dialect == "sqlite" else "IGNORE"
+    db.execute("DROP TABLE IF EXISTS users_keyed")
+    db.execute("CREATE TABLE users_keyed {}".format(USER_COLUMNS.format(",\n    PRIMARY KEY (userId)")))
+    db.execute("INSERT {} INTO users_keyed SELECT * FROM users".format(ignore))
+
+    if db.dialect == "sqlite":
+        db.execute("ALTER TABLE users RENAME TO users_unkeyed")
+        db.execute("ALTER TABLE users_keyed RENAME TO users")
+    else:
+        db.execute("RENAME TABLE users TO users_unkeyed, users_keyed TO users")
+    db.execute("DROP TABLE users_unkeyed")
+
+
+def index_users() -> None:
+    """Adds the indexes used to find a department's IC and the active users"""
+    create_index("users", "idx_users_department_role", "(department, role)")
+    create_index("users", "idx_users_acc_status", "(accStatus)")
+
+
+def create_attendance() -> None:
+    """
+    Creates the attendance ledger, holding each user's status for each day.
+
+    version is bumped on every change, and syncedVersion records the last version written to the sheet.
+    """
+    db.execute("CREATE TABLE IF NOT EXISTS attendance ("
+               "userId bigint NOT NULL, "
+               "date date NOT NULL, "
+               "status varchar(255), "
+               "version int NOT NULL DEFAULT 1, "
+               "syncedVersion int NOT NULL DEFAULT 0, "
+               "updatedAt timestamp DEFAULT CURRENT_TIMESTAMP, "
+               "PRIMARY KEY (userId, date))")
+    create_index("attendance", "idx_attendance_date", "(date)")
+
+
+def create_conversation_state() -> None:
+    """Creates the table holding the state of users' unfinished conversations"""
+    db.execute("CREATE TABLE IF NOT EXISTS conversation_state ("
+               "userId bigint NOT NULL, "
+               "chatId bigint NOT NULL, "
+               "state int, "
+               "data text, "
+               "updatedAt timestamp DEFAULT CURRENT_TIMESTAMP, "
+               "PRIMARY KEY (userId, chatId))")
+
+
+def create_roster_changes() -> None:
+    """Creates the queue of users whose rows on the worksheet may need to change"""
+    if db.dialect == "sqlite":
+        key = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+    else:
+        key = "id bigint NOT NULL AUTO_INCREMENT PRIMARY KEY"
+    db.execute("CREATE TABLE IF NOT EXISTS roster_changes ("
+               "{}, "
+               "userId bigint NOT NULL, "
+               "queuedAt timestamp DEFAULT CURRENT_TIMESTAMP)".format(key))
+
+
+# version, description, migration
+MIGRATIONS = [
+    (1, "create users table", create_users),
+    (2, "primary key on users.userId", key_users),
+    (3, "indexes on users (department, role) and (accStatus)", index_users),
+    (4, "attendance ledger", create_attendance),
+    (5, "conversation state", create_conversation_state),
+    (6, "roster change queue", create_roster_changes),
+]
+
+
+def version() -> int:
+    """Returns the version of the schema"""
+    result = db.execute("SELECT MAX(version) FROM schema_version", fetch=True)
+    return result[0][0] or 0
+
+
+def migrate(target: int = None) -> int:
+    """
+    Applies the migrations which have not been applied yet, up to the target version if one is given.
+
+    Returns the version of the schema.
+    """
+    db.execute("CREATE TABLE IF NOT EXISTS schema_version ("
+               "version int NOT NULL PRIMARY KEY, "
+               "description varchar(255), "
+               "appliedAt timestamp DEFAULT CURRENT_TIMESTAMP)")
+
+    current = version()
+    for number, description, migration in MIGRATIONS:
+        if number <= current or (target is not None and number > target):
+            continue
+
+        logger.info("Migrating the schema to version %s: %s", number, description)
+        migration()
+        db.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (number, description))
+        current = number
+
+    logger.info("Schema is at version %s.", current)
+    return current
@@ -0,0 +1,140 @@
+"""
+Class for making requests to the Google Sheets API within its quota.
+
+Every request made by ggsheets goes through call(), which
+    - waits for a token from a requests-per-minute budget, so that bursts queue up instead of failing
+    - retries 429 errors with jittered exponential backoff, and 5xx errors too for requests which can safely be made
+      twice (reads and writes to a fixed range), as a request which failed with a 5xx may still have gone through
+    - coalesces identical metadata requests (open/worksheet) which are already in flight
+    - counts the calls, errors, retries, latency and time spent waiting for the budget of every method
+
+Author: eliaise
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import lazy
+from ratelimit import TokenBucket
+
+gspread = lazy.load("gspread")     # imported on first use
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUESTS_PER_MINUTE = 60
+MAX_RETRIES = 5
+BACKOFF_BASE = 1        # seconds before the first retry
+BACKOFF_CAP = 32        # longest wait between retries
+
+# methods which leave the spreadsheet the same however many times they are made
+IDEMPOTENT = frozenset(("open", "worksheet", "get_all_values", "update", "batch_update", "update_acell", "resize"))
+
+budget = TokenBucket(DEFAULT_REQUESTS_PER_MINUTE / 60, capacity=DEFAULT_REQUESTS_PER_MINUTE / 6)
+
+inflight = {}           # (method, function, args) -> Future of the request already being made
+inflight_lock = threading.Lock()
+
+counters = {}           # method -> statistics of its calls
+counters_lock = threading.Lock()
+
+observer = None         # called with (method, seconds, throttle wait, failed) after every request, if metrics are on
+
+
+def configure(configs: dict) -> None:
+    """Sets the request budget according to the configuration file"""
+    global budget
+
+    per_minute = configs.get("requests_per_minute") or DEFAULT_REQUESTS_PER_MINUTE
+    budget = TokenBucket(per_minute / 60, capacity=max(per_minute / 6, 1))
+    logger.info("Limiting Google Sheets requests to %s per minute.", per_minute)
+
+
+def _count(method: str, **amounts) -> None:
+    """Adds to the statistics of the method"""
+    with counters_lock:
+        stats = counters.setdefault(method, {
+            "calls": 0, "errors": 0, "retries": 0, "coalesced": 0, "latency": 0.0, "throttle_wait": 0.0
+        })
+        for key, amount in amounts.items():
+            stats[key] += amount
+
+
+def retryable(method: str, error: Exception) -> bool:
+    """Whether the request may succeed if it is made again, without being applied twice"""
+    if not isinstance(error, gspread.exceptions.APIError):
+        return False
+    status = error.response.status_code
+    return status == 429 or (500 <= status < 600 and method in IDEMPOTENT)
+
+
+def _request(method: str, func, *args, **kwargs):
+    """Makes the request within the budget, retrying it if it fails with a retryable error"""
+    for attempt in range(MAX_RETRIES + 1):
+        wait = budget.reserve()
+        if wait:
+            time.sleep(wait)
+
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            _count(method, calls=1, errors=1, latency=elapsed, throttle_wait=wait)
+            if observer:
+                observer(method, elapsed, wait, True)
+            if not retryable(method, e) or attempt == MAX_RETRIES:
+                raise
+
+            backoff = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+            logger.warning("%s failed with %s, retrying in %.1fs.", method, e.response.status_code, backoff)
+            _count(method, retries=1)
+            time.sleep(backoff)
+            continue
+
+        elapsed = time.perf_counter() - start
+        _count(method, calls=1, latency=elapsed, throttle_wait=wait)
+        if observer:
+            observer(method, elapsed, wait, False)
+        return result
+
+
+def call(method: str, func, *args, coalesce: bool = False, **kwargs):
+    """
+    Calls the gspread function and returns its result.
+
+    With coalesce, a caller making the same request as one already in flight waits for that request's result
+    instead of making its own. Only use it for requests which read metadata.
+    """
+    if not coalesce:
+        return _request(method, func, *args, **kwargs)
+
+    key = (method, func, args)
+    with inflight_lock:
+        future = inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            inflight[key] = future
+
+    if not owner:
+        _count(method, coalesced=1)
+        return future.result()
+
+    try:
+        result = _request(method, func, *args, **kwargs)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with inflight_lock:
+            del inflight[key]
+
+
+def stats() -> dict:
+    """Returns the statistics of every method"""
+    with counters_lock:
+        return {method: dict(values) for method, values in counters.items()}
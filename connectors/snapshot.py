@@ -0,0 +1,125 @@
+"""
+Class for keeping a snapshot of today's attendance in memory.
+
+The snapshot is seeded with the day's roster when the sheet is created, and updated as users change their status,
+so that a department's roll-call can be served without going to Google Sheets or the database.
+
+Author: eliaise
+"""
+import logging
+import threading
+from collections import Counter
+
+import constants
+
+logger = logging.getLogger(__name__)
+
+PRESENT, LEAVE, UNKNOWN = "present", "leave", "unknown"
+
+users = {}          # userId -> {"title", "name", "department", "status"}
+departments = {}    # department -> {"members": set of userIds, "counts": Counter of PRESENT/LEAVE/UNKNOWN}
+lock = threading.Lock()
+
+
+def category(status) -> str:
+    """Returns whether the status counts as present, leave or unknown"""
+    if not status:
+        return UNKNOWN
+    if status.lower() in constants.PRESENT_STATUSES:
+        return PRESENT
+    return LEAVE
+
+
+def _add(row) -> None:
+    """Adds a roster row (userId, title, name, department, status) to the snapshot"""
+    user_id, title, name, department, status = row[:5]
+    user_id = str(user_id)
+    if user_id in users:
+        return
+
+    users[user_id] = {"title": title, "name": name, "department": department, "status": status or None}
+    group = departments.setdefault(department, {"members": set(), "counts": Counter()})
+    group["members"].add(user_id)
+    group["counts"][category(status)] += 1
+
+
+def load(rows: list) -> None:
+    """Replaces the snapshot with the day's roster"""
+    global users, departments
+
+    logger.info("Loading %s users into the attendance snapshot.", len(rows))
+    with lock:
+        users = {}
+        departments = {}
+        for row in rows:
+            _add(row)
+
+
+def add(rows: list) -> None:
+    """Adds users who joined the roster during the day"""
+    with lock:
+        for row in rows:
+            _add(row)
+
+
+def _remove(user_id) -> None:
+    """Removes a user from the snapshot"""
+    user = users.pop(str(user_id), None)
+    if not user:
+        return
+
+    group = departments[user["department"]]
+    group["members"].discard(str(user_id))
+    group["counts"][category(user["status"])] -= 1
+    if not group["members"]:
+        del departments[user["department"]]
+
+
+def update(rows: list) -> None:
+    """Adds users who joined the roster during the day, or replaces the details of users already on it"""
+    with lock:
+        for row in rows:
+            user = users.get(str(row[0]))
+            if user and not row[4]:
+                # rows without a status keep the one already in the snapshot
+                row = tuple(row[:4]) + (user["status"],)
+            _remove(row[0])
+            _add(row)
+
+
+def remove(user_ids: list) -> None:
+    """Removes users who left the roster during the day"""
+    with lock:
+        for user_id in user_ids:
+            _remove(user_id)
+
+
+def set_status(user_id, status: str) -> bool:
+    """Records the user's new status. Returns False if the user is not on today's roster."""
+    with lock:
+        user = users.get(str(user_id))
+        if not user:
+            return False
+
+        counts = departments[user["department"]]["counts"]
+        counts[category(user["status"])] -= 1
+        counts[category(status)] += 1
+        user["status"] = status
+        return True
+
+
+def roll_call(department: str):
+    """
+    Returns the counts of the department, and its members as (title, name, status) sorted by title and name.
+    None if the department has no one on today's roster.
+    """
+    with lock:
+        group = departments.get(department)
+        if not group:
+            return None
+
+        counts = {key: group["counts"][key] for key in (PRESENT, LEAVE, UNKNOWN)}
+        members = [users[user_id] for user_id in group["members"]]
+        members = [(member["title"], member["name"], member["status"]) for member in members]
+
+    return counts, sorted(members, key=lambda member: (member[0], member[1]))
@@ -1,12 +1,22 @@
 REGEX_NAME = "^[a-zA-Z ]{1,100}$"
 REGEX_TITLE = "^[A-Z0-9]{3,4}$"
 REGEX_DEPARTMENT = "^[a-zA-Z0-9 ]{2,5}$"
+REGEX_STATUS = "^[a-zA-Z0-9 ]{1,30}$"
+
+# statuses counted as present by /pull, any other status is counted as leave
+PRESENT_STATUSES = ("present", "in office", "wfh", "work from home")
 
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
 WORKBOOK_NAME = "Attendance_%b%Y"
 SHEET_NAME = "%d%b"
+TEMPLATE_NAME = "Template"
 SHEET_ROWS = 250
-SHEET_COLUMNS = 4
+SHEET_COLUMNS = 5
+SHEET_HEADER = ["User ID", "Title", "Name", "Department", "Status"]
+STATUS_COLUMN = "E"
 
-SELECT_ACTIVE_USERS = "SELECT userId, title, name, department, NULL AS status FROM users WHERE accStatus = 1"
+# users who have a row on the daily worksheet
+ON_ROSTER = "accStatus = 1"
+SELECT_ACTIVE_USERS = "SELECT userId, title, name, department, NULL AS status FROM users WHERE " + ON_ROSTER
+SELECT_ROSTER = SELECT_ACTIVE_USERS + " ORDER BY department, title, name"
@@ -0,0 +1,32 @@
+"""
+Function for deferring the import of heavy modules until they are first used.
+
+gspread and mysql.connector take a good part of a second to import between them. Modules which use them import them
+through load() instead, so that the bot can start taking updates while they are still unused, and the import happens
+in whichever thread first touches the module, e.g. while connecting to the backends in the background.
+
+Author: eliaise
+"""
+import importlib.util
+import sys
+import threading
+
+lock = threading.Lock()
+
+
+def load(name: str):
+    """Returns the module, which is only imported when one of its attributes is first looked up"""
+    with lock:
+        if name in sys.modules:
+            return sys.modules[name]
+
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            raise ModuleNotFoundError("No module named '{}'".format(name), name=name)
+
+        loader = importlib.util.LazyLoader(spec.loader)
+        spec.loader = loader
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        loader.exec_module(module)
+        return module
@@ -0,0 +1,113 @@
+"""
+Class for setting up the logging of the whole bot.
+
+Modules only create their loggers. setup() puts a queue handler on the root logger, and a listener thread writes the
+queued records to the console, so that logging never blocks the event loop on I/O.
+
+The records logged for every database statement and for every message handled are sampled and rate limited, as set
+in the [Logging] section of the configuration file. Warnings, errors and exceptions are never dropped.
+
+Author: eliaise
+"""
+import logging
+import queue
+import random
+import threading
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+import constants
+from ratelimit import TokenBucket
+
+# loggers whose records are sampled -> the kind of records they log
+SAMPLED = {
+    "connectors.db": "query",
+    "__main__": "message",
+    "main": "message",
+}
+
+listener = None
+sampler = None
+
+
+class Sampler(logging.Filter):
+    """Keeps a fraction of the records of each kind, up to a number per second. Warnings and above always pass."""
+
+    def __init__(self):
+        super().__init__()
+        self.rates = {}         # kind -> fraction of records kept
+        self.buckets = {}       # kind -> TokenBucket limiting the records kept per second
+        self.dropped = Counter()
+        self.lock = threading.Lock()
+
+    def configure(self, kind: str, rate: float, per_second: float) -> None:
+        self.rates[kind] = rate
+        self.buckets[kind] = TokenBucket(per_second) if per_second else None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        kind = SAMPLED.get(record.name)
+        if kind is None:
+            return True
+
+        rate = self.rates.get(kind, 1)
+        bucket = self.buckets.get(kind)
+        if (rate < 1 and random.random() >= rate) or (bucket and not bucket.try_take()):
+            with self.lock:
+                self.dropped[kind] += 1
+            return False
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.dropped)
+
+
+def setup() -> None:
+    """Sends every record through a queue to a console handler running in its own thread"""
+    global listener, sampler
+
+    if listener:
+        return
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(constants.LOG_FORMAT))
+
+    records = queue.SimpleQueue()
+    sampler = Sampler()
+    handler = QueueHandler(records)
+    handler.addFilter(sampler)
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+
+    listener = QueueListener(records, console, respect_handler_level=True)
+    listener.start()
+
+
+def configure(configs: dict) -> None:
+    """Sets the level and the sampling of the records according to the configuration file"""
+    setup()
+    logging.getLogger().setLevel(configs.get("log_level") or "INFO")
+    sampler.configure("query", configs.get("log_query_sample", 1), configs.get("log_query_limit", 0))
+    sampler.configure("message", configs.get("log_message_sample", 1), configs.get("log_message_limit", 0))
+    logging.getLogger(__name__).info("Logging at %s, sampling query records at %s and message records at %s.",
+                                     logging.getLevelName(logging.getLogger().level),
+                                     configs.get("log_query_sample", 1), configs.get("log_message_sample", 1))
+
+
+def stats() -> dict:
+    """Returns the number of records dropped of each kind"""
+    return sampler.stats() if sampler else {}
+
+
+def stop() -> None:
+    """Writes out the records still queued, and stops the listener"""
+    global listener
+
+    if listener:
+        listener.stop()
+        listener = None
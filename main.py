@@ -9,11 +9,18 @@ E.g.
 Author: eliaise
 """
 
+import asyncio
+import io
 import logging
+import os
+import signal
+import tempfile
+import time
+from datetime import date, datetime
+from functools import partial, wraps
 
 from telegram import (
     Update,
-    Bot,
     InlineKeyboardButton,
     InlineKeyboardMarkup
 )
@@ -23,57 +30,207 @@ from telegram.ext import (
     ConversationHandler,
     ContextTypes,
     MessageHandler,
-    filters, CallbackQueryHandler,
+    filters, CallbackQueryHandler, TypeHandler, ApplicationHandlerStop,
 )
 from re import search
+import admission
 import config
-from connectors import db, ggsheets
+import logconfig
+import metrics
+import webhook
+from connectors import db, ggsheets, cache, migrations, snapshot, ledger, sheetsapi, conversations
 import constants
+from workers import sheetWorker, flushWorker, scheduler, sendWorker, importWorker, rosterWorker, reminderWorker, \
+    statsWorker, exportWorker
 
-# Enable logging
-from workers import sheetWorker
-
-logging.basicConfig(
-    format=constants.LOG_FORMAT, level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # conversation states
 NAME, TITLE, DEPARTMENT, RESTART, ERROR, CANCEL = range(6)
 
+# user_data kept across restarts while registering
+REGISTRATION_FIELDS = ("name", "title", "department")
+
+# registrants listed per page by /pending
+PAGE_SIZE = 20
+
+# longest message Telegram accepts
+MESSAGE_LENGTH = 4096
+
+# largest file a bot can send
+MAX_UPLOAD = 50 * 1024 * 1024
+DEFAULT_EXPORTS = 2
+
+# updates which arrive before the backends are connected are held for up to this long after startup
+STARTUP_WAIT = 10           # seconds
+CONNECT_ATTEMPTS = 5
+CONNECT_DELAY = 5           # seconds between attempts to connect to a backend
+
 # telegram
 bot_token = None
 drive_token = None
 
+configs = None
+
+registration_handler = None
+exports = None      # caps the exports prepared at once, as each holds a job thread
+
+started = None      # time the process started setting up
+timings = {}        # startup step -> seconds taken
+ready = None        # set once the backends are connected
+deadline = None     # loop time after which updates are no longer held for the backends
+warming = None      # task connecting to the backends
+
+
+def pending_markup(state: dict) -> InlineKeyboardMarkup:
+    """Creates the multi-select keyboard for the current page of pending registrants"""
+    start = state["page"] * PAGE_SIZE
+    choices = [
+        [InlineKeyboardButton("{} {} {}".format("[x]" if user_id in state["selected"] else "[ ]", title, name),
+                              callback_data="Bulk Toggle {}".format(user_id))]
+        for user_id, title, name in state["pending"][start:start + PAGE_SIZE]
+    ]
+
+    pages = []
+    if state["page"] > 0:
+        pages.append(InlineKeyboardButton("Previous", callback_data="Bulk Page {}".format(state["page"] - 1)))
+    if start + PAGE_SIZE < len(state["pending"]):
+        pages.append(InlineKeyboardButton("Next", callback_data="Bulk Page {}".format(state["page"] + 1)))
+    if pages:
+        choices.append(pages)
+
+    choices.append([
+        InlineKeyboardButton("Select all", callback_data="Bulk All"),
+        InlineKeyboardButton("Clear", callback_data="Bulk None")
+    ])
+    choices.append([
+        InlineKeyboardButton("Approve selected", callback_data="Bulk Approve"),
+        InlineKeyboardButton("Reject selected", callback_data="Bulk Reject")
+    ])
+    return InlineKeyboardMarkup(choices)
+
+
+async def decide(department: str, user_ids: list, approve: bool) -> bool:
+    """
+    Approves or rejects the pending registrants of the department with a single update, and queues them for the
+    roster worker to add to, or keep off, today's sheet.
+    """
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    stmt = "UPDATE users SET accStatus = %s WHERE department = %s AND accStatus = 0 " \
+           "AND userId IN ({})".format(placeholders)
+    result = await db.run_update(stmt, (1 if approve else -1, department, *user_ids))
+    for user_id in user_ids:
+        cache.users.invalidate(user_id)
+
+    if not result:
+        return False
+
+    await rosterWorker.changed(user_ids)
+    return True
+
+
+async def handle_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles the multi-select keyboard of the /pending command"""
+    query = update.callback_query
+    await query.answer()
+
+    state = context.user_data.get("bulk")
+    if not state:
+        await query.edit_message_text(text="This list has expired. Do a /pending to get a new one.")
+        return
+
+    action = query.data.split()[1:]
+    if action[0] == "Toggle":
+        user_id = int(action[1])
+        state["selected"] ^= {user_id}
+    elif action[0] == "Page":
+        state["page"] = int(action[1])
+    elif action[0] == "All":
+        state["selected"] = {user_id for user_id, _, _ in state["pending"]}
+    elif action[0] == "None":
+        state["selected"] = set()
+    else:
+        if not state["selected"]:
+            await query.message.reply_text("Nobody has been selected.")
+            return
+
+        approve = action[0] == "Approve"
+        user_ids = sorted(state["selected"])
+        logger.info("%s %s users of the %s department.", action[0], len(user_ids), state["department"])
+        if not await decide(state["department"], user_ids, approve):
+            await query.message.reply_text("An exception was caught. Please contact the administrator for help.")
+            return
+
+        del context.user_data["bulk"]
+        await query.edit_message_text(text="{} {} users.".format("Approved" if approve else "Rejected",
+                                                                 len(user_ids)))
+        return
+
+    await query.edit_message_reply_markup(reply_markup=pending_markup(state))
+
+
+async def handle_pending(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Lists the pending registrants of the IC's department for approval or rejection in bulk."""
+    user_id = update.message.from_user.id
+    user = await cache.get_user(user_id)
+    if not user or user["accStatus"] != 1 or user["role"] not in ("IC", "Admin"):
+        await update.message.reply_text("Only the person in-charge of a department can approve registrations.")
+        return
+
+    # admins may look after any department
+    department = user["department"]
+    if user["role"] == "Admin" and context.args:
+        department = " ".join(context.args)
+
+    stmt = "SELECT userId, title, name FROM users WHERE department = %s AND accStatus = 0 ORDER BY title, name"
+    result = await db.run_select(stmt, (department,))
+    if result is None:
+        await update.message.reply_text("An exception was caught. Please contact the administrator for help.")
+        return
+    if not result:
+        await update.message.reply_text("There are no pending registrations for the {} department.".format(department))
+        return
+
+    state = {"department": department, "pending": [tuple(row) for row in result], "selected": set(), "page": 0}
+    context.user_data["bulk"] = state
+    await update.message.reply_text("{} pending registrations for the {} department. "
+                                    "Select the users to approve or reject.".format(len(result), department),
+                                    reply_markup=pending_markup(state))
+
 
 async def handle_notify(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Parses the approval or reject response from the IC"""
     query = update.callback_query
     await query.answer()
 
-    # extracting out the title and name
+    # extracting out the title and name, and the user id of the registrant
     registrant = search(r'(.*) is', query.message.text).groups()[0]
-    stmt = "UPDATE users SET accStatus = ? WHERE userId = ?"
+    decision, user_id = query.data.split()
+    user_id = int(user_id)
+    stmt = "UPDATE users SET accStatus = %s WHERE userId = %s"
 
-    if query.data.startswith("Approve"):
-        result = db.run_update(stmt, (1, registrant))
+    if decision == "Approve":
+        result = await db.run_update(stmt, (1, user_id))
+        cache.users.invalidate(user_id)
         if result:
+            await rosterWorker.changed([user_id])
             await query.edit_message_text(text="Approved {}".format(registrant))
             return
     else:
-        result = db.run_update(stmt, (-1, registrant))
+        result = await db.run_update(stmt, (-1, user_id))
+        cache.users.invalidate(user_id)
         if result:
+            await rosterWorker.changed([user_id])
             await query.edit_message_text(text="Rejected {}".format(registrant))
             return
 
     # error
-    await update.message.reply_text("An exception was caught. Please contact the administrator for help.")
+    await query.message.reply_text("An exception was caught. Please contact the administrator for help.")
 
 
 async def notify(user_id: int, name: str, title: str, department: str) -> bool:
     """Notifies the relevant person in-charge that there is an outstanding registration request"""
-    logger.info("Sending notification to person in-charge of {} department.".format(department))
-    bot = Bot(bot_token)
+    logger.info("Sending notification to person in-charge of %s department.", department)
 
     # create approve or reject buttons
     choices = [
@@ -84,42 +241,71 @@ async def notify(user_id: int, name: str, title: str, department: str) -> bool:
     ]
     reply_markup = InlineKeyboardMarkup(choices)
 
-    # find the person in-charge
-    stmt = "SELECT chatId FROM users where department = %s and role = 'IC'"
-    result = db.run_select(stmt, (department,))
+    # find the person in-charge, or an admin if the department has none
+    contact = await cache.get_contact(department)
+    if not contact:
+        logger.error("No admin found.")
+        return False
 
-    if result:
+    chat_id, role = contact
+    if role == "IC":
         # contact this IC
-        ic = result[0]
-        await bot.send_message(chat_id=ic,
-                               text="{} {} is requesting to join your team.".format(title, name),
-                               reply_markup=reply_markup
-                               )
+        sendWorker.send(chat_id,
+                        "{} {} is requesting to join your team.".format(title, name),
+                        reply_markup=reply_markup,
+                        priority=sendWorker.URGENT)
     else:
         # contact an admin
-        stmt = "SELECT chatId FROM users where role = 'Admin' LIMIT 1"
-        result = db.run_select(stmt, None)
-        if not result:
-            logger.error("No admin found.")
-            return False
-
-        admin = result[0][0]
-        logger.info("Contacting {} for approval.".format(admin))
-        await bot.send_message(chat_id=admin,
-                               text="{} {} is requesting to join the {} department.".format(title, name, department),
-                               reply_markup=reply_markup)
+        logger.info("Contacting %s for approval.", chat_id)
+        sendWorker.send(chat_id,
+                        "{} {} is requesting to join the {} department.".format(title, name, department),
+                        reply_markup=reply_markup,
+                        priority=sendWorker.URGENT)
 
     return True
 
 
-def finish(user_id, chat_id, name, title, department) -> bool:
+async def finish(user_id, chat_id, name, title, department) -> bool:
     """Finish the registration process."""
-    logger.info("Finishing registration for user {}.".format(user_id))
-
-    # finish registration
-    logger.info("Finishing registration for user {}".format(user_id))
+    logger.info("Finishing registration for user %s", user_id)
     stmt = "INSERT INTO users VALUES (%s, %s, %s, %s, %s, %s, %s)"
-    return db.run_insert(stmt, (user_id, chat_id, name, title, department, "User", 0))
+    result = await db.run_insert(stmt, (user_id, chat_id, name, title, department, "User", 0))
+    cache.users.invalidate(user_id)
+    return result
+
+
+def persist(func):
+    """Wraps a registration handler so that the state it moves the conversation to is saved"""
+
+    @wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        state = await func(update, context)
+        user_id, chat_id = update.effective_user.id, update.effective_chat.id
+        if state == ConversationHandler.END:
+            conversations.end(user_id, chat_id)
+        elif state is not None:
+            data = {key: context.user_data[key] for key in REGISTRATION_FIELDS if key in context.user_data}
+            conversations.save(user_id, chat_id, state, data)
+        return state
+
+    return wrapper
+
+
+async def restore_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Restores the user's registration progress saved before a restart, the first time the user is heard from."""
+    if not update.effective_user or not update.effective_chat:
+        return
+
+    user_id, chat_id = update.effective_user.id, update.effective_chat.id
+    saved = await conversations.restore(user_id, chat_id)
+    if not saved:
+        return
+
+    state, data = saved
+    logger.info("Restoring the registration of user %s at state %s.", user_id, state)
+    context.user_data.update(data)
+    # ConversationHandler has no public way to set a conversation's state without loading every conversation
+    registration_handler._conversations[(chat_id, user_id)] = state
 
 
 async def handle_error(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -144,15 +330,15 @@ async def handle_department(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # test whether the department is valid
     match = search(constants.REGEX_DEPARTMENT, department)
     if not match:
-        logger.info("User {} submitted an invalid department. Restarting...")
+        logger.info("User %s submitted an invalid department. Restarting...", user_id)
         await update.message.reply_text("Department given is invalid. "
                                         "Please give a valid department. E.g. IT")
         return DEPARTMENT
 
-    logger.info("Saving {} as the department for user {}".format(department, user_id))
+    logger.info("Saving %s as the department for user %s", department, user_id)
     context.user_data["department"] = department
     await update.message.reply_text("Okay! Finalising registration.")
-    success = finish(
+    success = await finish(
         user_id,
         update.message.chat.id,
         context.user_data["name"],
@@ -186,12 +372,12 @@ async def handle_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     # test whether this title is valid
     match = search(constants.REGEX_TITLE, title)
     if not match:
-        logger.info("User {} submitted an invalid title. Restarting...")
+        logger.info("User %s submitted an invalid title. Restarting...", user_id)
         await update.message.reply_text("Title given is invalid. "
                                         "Please give a valid title. E.g. exec")
         return TITLE
 
-    logger.info("Saving {} as the title for user {}".format(title, user_id))
+    logger.info("Saving %s as the title for user %s", title, user_id)
     context.user_data["title"] = title
     await update.message.reply_text("What is your department?")
     return DEPARTMENT
@@ -205,12 +391,12 @@ async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     # test whether this name is valid
     match = search(constants.REGEX_NAME, name)
     if not match:
-        logger.info("User {} submitted an invalid name. Restarting...")
+        logger.info("User %s submitted an invalid name. Restarting...", user_id)
         await update.message.reply_text("Name given contains invalid characters or is too long. "
                                         "Please give a valid name.")
         return NAME
 
-    logger.info("Saving {} as the name for user {}".format(name, user_id))
+    logger.info("Saving %s as the name for user %s", name, user_id)
     context.user_data["name"] = name
     await update.message.reply_text("What is your title?")
     return TITLE
@@ -220,16 +406,14 @@ async def handle_register(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Handles the registration process of the user."""
     # get user's telegram id
     user_id = update.message.from_user.id
-    logger.info("Starting user registration for user {}".format(user_id))
+    logger.info("Starting user registration for user %s", user_id)
 
     # check if this user exists in database
-    stmt = "SELECT name, accStatus FROM users WHERE userId = %s"
-    result = db.run_select(stmt, (user_id,))
+    user = await cache.get_user(user_id)
 
-    if result:
-        logger.info("User {} exists in database".format(user_id))
-        name, acc_status = result[0]
-        logger.info(acc_status)
+    if user:
+        logger.info("User %s exists in database", user_id)
+        name, acc_status = user["name"], user["accStatus"]
         if acc_status == 1:
             await update.message.reply_text(
                 "Hello {}. You have already been registered into the database.".format(name))
@@ -237,7 +421,7 @@ async def handle_register(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.message.reply_text(
                 "Hello {}. Your application has been rejected. Please contact your supervisor.".format(name))
         else:
-            logger.info("User {}'s account is pending approval")
+            logger.info("User %s's account is pending approval", user_id)
             await update.message.reply_text("Hello {}. Your account is pending approval. "
                                             "Please check back in a few hours.".format(name))
         return ConversationHandler.END
@@ -252,10 +436,215 @@ async def handle_register(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the user's status update."""
     user_id = update.message.from_user.id
-    status = update.message.text
-    logger.info("Updating the status to {} for user {}".format(status, user_id))
+    status = " ".join(context.args)
+
+    # test whether the status is valid
+    match = search(constants.REGEX_STATUS, status)
+    if not match:
+        logger.info("User %s submitted an invalid status.", user_id)
+        await update.message.reply_text("Status given is invalid. "
+                                        "Please give a valid status. E.g. /update Present")
+        return
+
+    # only approved users have a row in the spreadsheet
+    user = await cache.get_user(user_id)
+    if not user or user["accStatus"] != 1:
+        logger.info("User %s is not an approved user.", user_id)
+        await update.message.reply_text("You are not a registered user. Do a /register first.")
+        return
+
+    # the status is recorded in the ledger, and the spreadsheet is updated in the background
+    logger.info("Updating the status to %s for user %s", status, user_id)
+    if not await ledger.record(user_id, status):
+        await update.message.reply_text("An exception was caught. Please contact the administrator for help.")
+        return
+
+    snapshot.set_status(user_id, status)
+    flushWorker.submit(user_id, status)
+    await update.message.reply_text("Your status has been updated to {}.".format(status))
+
+
+async def handle_pull(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Displays the attendance of everyone in the user's department."""
+    user_id = update.message.from_user.id
+    user = await cache.get_user(user_id)
+    if not user or user["accStatus"] != 1:
+        await update.message.reply_text("You are not a registered user. Do a /register first.")
+        return
+
+    department = user["department"]
+    result = snapshot.roll_call(department)
+    if not result:
+        await update.message.reply_text("Today's attendance for the {} department is not ready yet.".format(department))
+        return
+
+    counts, members = result
+    lines = ["{} department: {} present, {} on leave, {} unknown".format(
+        department, counts[snapshot.PRESENT], counts[snapshot.LEAVE], counts[snapshot.UNKNOWN])]
+    lines += ["{} {}: {}".format(title, name, status or "-") for title, name, status in members]
+    await reply_lines(update, lines)
+
+
+async def reply_lines(update: Update, lines: list) -> None:
+    """Replies with the lines, split over as many messages as Telegram's message length limit needs"""
+    message = ""
+    for line in lines:
+        if len(message) + len(line) + 1 > MESSAGE_LENGTH:
+            await update.message.reply_text(message)
+            message = ""
+        message += line + "\n"
+    await update.message.reply_text(message)
+
+
+async def parse_range(update: Update, user: dict, args: list, what: str):
+    """
+    Parses the [department] [from] [to] arguments of a command, replying if they are invalid.
+
+    The range defaults to the month so far. Admins may give any department, or none for all of them, and an IC only
+    their own. Returns (department, start, end), or None if the user was told what was wrong.
+    """
+    # the dates come last, as department names may have spaces
+    dates = []
+    try:
+        while args and len(dates) < 2 and search(r"^\d{4}-\d{2}-\d{2}$", args[-1]):
+            dates.insert(0, datetime.strptime(args.pop(), "%Y-%m-%d").date())
+    except ValueError:
+        await update.message.reply_text("Date given is invalid. Please give a date like 2022-12-31.")
+        return None
+
+    today = date.today()
+    start = dates[0] if dates else today.replace(day=1)
+    end = dates[1] if len(dates) > 1 else today
+    if start > end:
+        await update.message.reply_text("The first day given is after the last.")
+        return None
+
+    department = user["department"]
+    if user["role"] == "Admin":
+        department = " ".join(args) or None
+    elif args and " ".join(args) != department:
+        await update.message.reply_text("You can only view the {} of the {} department.".format(what, department))
+        return None
+
+    return department, start, end
+
+
+async def handle_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Reports the presence, leave and missing rates of a department over a range of days."""
+    user_id = update.message.from_user.id
+    user = await cache.get_user(user_id)
+    if not user or user["accStatus"] != 1 or user["role"] not in ("IC", "Admin"):
+        await update.message.reply_text("Only the person in-charge of a department can view its statistics.")
+        return
+
+    selection = await parse_range(update, user, list(context.args), "statistics")
+    if not selection:
+        return
+
+    department, start, end = selection
+    try:
+        result = await scheduler.run_blocking(statsWorker.report, start, end, department)
+    except Exception as e:
+        logger.exception(e)
+        await update.message.reply_text("An exception was caught. Please contact the administrator for help.")
+        return
+
+    await reply_lines(update, statsWorker.summary(result))
+
+
+async def handle_download(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends the attendance of a department over a range of days, as a CSV file or an Excel workbook."""
+    user_id = update.message.from_user.id
+    user = await cache.get_user(user_id)
+    if not user or user["accStatus"] != 1 or user["role"] not in ("IC", "Admin"):
+        await update.message.reply_text("Only the person in-charge of a department can download its attendance.")
+        return
+
+    # /download [department] [from] [to] [csv|xlsx]
+    args = list(context.args)
+    form = args.pop().lower() if args and args[-1].lower() in exportWorker.FORMATS else "csv"
+    selection = await parse_range(update, user, args, "attendance")
+    if not selection:
+        return
+
+    department, start, end = selection
+    if exports.locked():
+        await update.message.reply_text("Too many downloads are being prepared. Please try again shortly.")
+        return
+
+    async with exports:
+        logger.info("Exporting the attendance of %s from %s to %s for user %s.", department, start, end, user_id)
+        with tempfile.TemporaryFile() as file:
+            try:
+                await scheduler.run_blocking(exportWorker.export, file, start, end, department, form)
+            except Exception as e:
+                logger.exception(e)
+                await update.message.reply_text("An exception was caught. Please contact the administrator for help.")
+                return
+
+            if file.tell() > MAX_UPLOAD:
+                await update.message.reply_text("The attendance is too large to send. Please ask for fewer days.")
+                return
+
+            file.seek(0)
+            name = "attendance_{}_{}_{}.{}".format((department or "all").replace(" ", "_"), start, end, form)
+            await update.message.reply_document(file, filename=name)
+
+
+async def handle_resync(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Rebuilds a day's worksheet from the attendance ledger."""
+    user_id = update.message.from_user.id
+    user = await cache.get_user(user_id)
+    if not user or user["accStatus"] != 1 or user["role"] != "Admin":
+        await update.message.reply_text("Only an admin can resync the spreadsheet.")
+        return
+
+    try:
+        day = datetime.strptime(context.args[0], "%Y-%m-%d").date() if context.args else date.today()
+    except ValueError:
+        await update.message.reply_text("Date given is invalid. Please give a date like 2022-12-31.")
+        return
+
+    logger.info("Resyncing the worksheet of %s.", day)
+    await update.message.reply_text("Rebuilding the worksheet of {}.".format(day))
+    try:
+        rows = await scheduler.run_blocking(flushWorker.resync, day)
+    except Exception as e:
+        logger.exception(e)
+        await update.message.reply_text("An exception was caught. Please contact the administrator for help.")
+        return
+
+    await update.message.reply_text("Rebuilt the worksheet of {} with {} users.".format(day, rows))
+
+
+async def handle_import(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Imports a roster of users from the CSV file sent with /import as its caption."""
+    user_id = update.message.from_user.id
+    user = await cache.get_user(user_id)
+    if not user or user["accStatus"] != 1 or user["role"] != "Admin":
+        await update.message.reply_text("Only an admin can import users.")
+        return
+
+    document = update.message.document
+    if not document:
+        await update.message.reply_text("Send the roster as a CSV file with /import as its caption. "
+                                        "Each row is: userId, name, title, department, role")
+        return
+
+    logger.info("Importing the roster %s sent by user %s.", document.file_name, user_id)
+    with tempfile.TemporaryFile() as file:
+        await (await document.get_file()).download(out=file)
+        file.seek(0)
+        try:
+            report = await scheduler.run_blocking(importWorker.import_roster,
+                                                  io.TextIOWrapper(file, encoding="utf-8-sig", newline=""),
+                                                  sheetWorker.owner)
+        except Exception as e:
+            logger.exception(e)
+            await update.message.reply_text("An exception was caught. No users were imported.")
+            return
 
-    # TODO: update user's status
+    await update.message.reply_text(importWorker.summary(report)[:MESSAGE_LENGTH])
 
 
 async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -264,46 +653,272 @@ async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                                     "/register: starts the registration process "
                                     "/update <status>: sets your status for the day"
                                     "/pull: displays the attendance of all members in your department "
+                                    "/pending: approve or reject registrations for your department "
                                     "/role <role> <user>: sets the role of the target user "
+                                    "/resync [yyyy-mm-dd]: rebuilds a day's spreadsheet from the database "
+                                    "/import: adds the users in a CSV file sent with /import as its caption "
+                                    "/stats [department] [from] [to]: attendance rates over a range of days "
+                                    "/download [department] [from] [to] [csv|xlsx]: the attendance as a file "
                                     "/help: prints this message")
 
 
-def main() -> None:
-    """Starts the bot."""
-    global bot_token, drive_token
+def cache_gauges() -> dict:
+    """Reports the cache counters as metrics"""
+    values = {}
+    for name, stats in cache.stats().items():
+        for key, value in stats.items():
+            values[("attendance_cache_{}".format(key), "cache", name)] = value
+    return values
 
-    # read the config file
-    configs = config.read()
-    bot_token = configs.get("bot_token")
-    drive_token = configs.get("drive_token")
 
-    # connect to the database
-    db.connect(configs)
+def log_gauges() -> dict:
+    """Reports the log records dropped by sampling as metrics"""
+    return {("attendance_log_dropped_total", "kind", kind): count for kind, count in logconfig.stats().items()}
 
-    # start telegram application object
-    application = Application.builder().token(bot_token).build()
 
-    application.add_handler(CommandHandler("help", handle_help))
-    application.add_handler(CommandHandler("update", handle_update))
+def admission_gauges() -> dict:
+    """Reports the updates admitted, coalesced and shed as metrics"""
+    return {("attendance_updates_total", "outcome", outcome): count for outcome, count in admission.stats().items()}
+
+
+async def wait_until_ready(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Holds the updates which arrive while the backends are still being connected, for up to STARTUP_WAIT seconds after
+    startup. Once that has passed, the user is told to try again instead.
+    """
+    if ready.is_set():
+        return
+
+    try:
+        await asyncio.wait_for(ready.wait(), max(deadline - asyncio.get_running_loop().time(), 0))
+        return
+    except asyncio.TimeoutError:
+        pass
+
+    text = "The bot is starting up. Please try again in a moment."
+    if update.callback_query:
+        await update.callback_query.answer(text)
+    elif update.effective_message:
+        await update.effective_message.reply_text(text)
+    raise ApplicationHandlerStop
+
+
+async def connect_backend(name: str, func) -> None:
+    """Runs the blocking connection step in a job thread, retrying it until it succeeds or runs out of attempts"""
+    for attempt in range(1, CONNECT_ATTEMPTS + 1):
+        start = time.perf_counter()
+        try:
+            await scheduler.run_blocking(func)
+            timings[name] = time.perf_counter() - start
+            return
+        except Exception as e:
+            logger.error("Failed to connect to the %s, attempt %s of %s: %s", name, attempt, CONNECT_ATTEMPTS, e)
+            if attempt < CONNECT_ATTEMPTS:
+                await asyncio.sleep(CONNECT_DELAY)
+    raise RuntimeError("Could not connect to the {}.".format(name))
+
+
+def connect_database(migrate: bool) -> None:
+    """Creates the database connection pool, and brings the schema up to date if asked to"""
+    db.create_pool(configs)
+    if migrate:
+        migrations.migrate()
+
+
+def connect_sheets() -> None:
+    """Connects to Google Sheets"""
+    sheetsapi.configure(configs)
+    ggsheets.connect()
+
+
+async def warm_up(application: Application) -> None:
+    """Connects to the database and to Google Sheets side by side, then starts the jobs which need them"""
+    index, count = application.bot_data["worker"]
+    try:
+        await asyncio.gather(connect_backend("database", partial(connect_database, count == 1)),
+                             connect_backend("sheets", connect_sheets))
+    except Exception as e:
+        logger.exception(e)
+        logger.error("Stopping, as the backends could not be reached.")
+        if "stop" in application.bot_data:
+            # a webhook worker leaves its queue, and the receiver stops the other workers once it has exited
+            application.bot_data["stop"]()
+        else:
+            os.kill(os.getpid(), signal.SIGTERM)
+        return
+
+    start = time.perf_counter()
+    start_jobs(index, count)
+    timings["jobs"] = time.perf_counter() - start
+    ready.set()
+
+    timings["ready"] = time.perf_counter() - started
+    logger.info("Ready %.2fs after starting: %s", timings["ready"],
+                ", ".join("{} {:.2f}s".format(step, seconds) for step, seconds in timings.items()))
+
+
+async def startup(application: Application) -> None:
+    """Starts the background workers, and connects to the backends without holding up the first updates."""
+    global deadline, warming
+
+    sendWorker.start(application.bot, configs)
+    deadline = asyncio.get_running_loop().time() + STARTUP_WAIT
+    timings["accepting updates"] = time.perf_counter() - started
+    warming = asyncio.create_task(warm_up(application))
+
+
+async def shutdown(application: Application) -> None:
+    """Releases the resources held by the bot."""
+    if warming and not warming.done():
+        warming.cancel()
+    await sendWorker.stop()
+    await flushWorker.stop()
+    if ready.is_set():
+        await scheduler.run_blocking(conversations.flush)
+    scheduler.shutdown()
+    db.close()
+    metrics.shutdown()
+    logger.info("Cache statistics: %s", cache.stats())
+    logger.info("Google Sheets statistics: %s", sheetsapi.stats())
+    logger.info("Log records dropped by sampling: %s", logconfig.stats())
+    logger.info("Updates admitted, coalesced and shed: %s", admission.stats())
+    logconfig.stop()
+
+
+def build(index: int = 0, count: int = 1) -> Application:
+    """
+    Builds the application, and schedules its background jobs.
+
+    With webhook workers, index and count are the worker's number and the number of workers. Worker 0 owns the
+    spreadsheet, and every worker refreshes its attendance snapshot from the ledger.
+    """
+    global registration_handler, exports, ready
+
+    primary = index == 0
+    exports = asyncio.Semaphore(configs.get("max_exports") or DEFAULT_EXPORTS)
+    ready = asyncio.Event()
+    admission.configure(configs)
+
+    # collect metrics, if enabled
+    if count > 1:
+        configs["metrics_port"] += index
+    if metrics.init(configs):
+        db.observer = metrics.observe_query
+        sheetsapi.observer = metrics.observe_sheets
+        scheduler.observer = metrics.observe_job
+        metrics.gauges.append(cache_gauges)
+        metrics.gauges.append(log_gauges)
+        metrics.gauges.append(admission_gauges)
+
+    # start telegram application object
+    application = Application.builder().token(bot_token).post_init(startup).post_shutdown(shutdown).build()
+    application.bot_data["worker"] = (index, count)
+
+    application.add_handler(CommandHandler("help", metrics.handler(handle_help)))
+    application.add_handler(CommandHandler("update", metrics.handler(handle_update)))
+    application.add_handler(CommandHandler("pull", metrics.handler(handle_pull)))
+    application.add_handler(CommandHandler("resync", metrics.handler(handle_resync)))
+    application.add_handler(CommandHandler("stats", metrics.handler(handle_stats)))
+    application.add_handler(CommandHandler("download", metrics.handler(handle_download)))
+    application.add_handler(CommandHandler("import", metrics.handler(handle_import)))
+    application.add_handler(MessageHandler(filters.Document.FileExtension("csv") & filters.CaptionRegex(r"^/import"),
+                                           metrics.handler(handle_import)))
     registration_handler = ConversationHandler(
-        entry_points=[CommandHandler("register", handle_register)],
+        entry_points=[CommandHandler("register", metrics.handler(persist(handle_register)))],
         states={
-            NAME: [MessageHandler(filters.TEXT, handle_name)],
-            TITLE: [MessageHandler(filters.TEXT, handle_title)],
-            DEPARTMENT: [MessageHandler(filters.TEXT, handle_department)],
-            RESTART: [CommandHandler("restart", handle_register)],
-            ERROR: [CommandHandler("error", handle_error)],
-            CANCEL: [CommandHandler("cancel", handle_cancel)]
+            NAME: [MessageHandler(filters.TEXT, metrics.handler(persist(handle_name)))],
+            TITLE: [MessageHandler(filters.TEXT, metrics.handler(persist(handle_title)))],
+            DEPARTMENT: [MessageHandler(filters.TEXT, metrics.handler(persist(handle_department)))],
+            RESTART: [CommandHandler("restart", metrics.handler(persist(handle_register)))],
+            ERROR: [CommandHandler("error", metrics.handler(persist(handle_error)))],
+            CANCEL: [CommandHandler("cancel", metrics.handler(persist(handle_cancel)))]
         },
-        fallbacks=[MessageHandler(filters.TEXT, handle_error)]
+        fallbacks=[MessageHandler(filters.TEXT, metrics.handler(persist(handle_error)))]
     )
 
     application.add_handler(registration_handler)
-    application.add_handler(CallbackQueryHandler(handle_notify, pattern='^(Approve|Reject) [1-9]{1,}$'))
+    application.add_handler(TypeHandler(Update, admission.gate), group=-3)
+    application.add_handler(TypeHandler(Update, wait_until_ready), group=-2)
+    application.add_handler(TypeHandler(Update, restore_conversation), group=-1)
+    application.add_handler(CallbackQueryHandler(metrics.handler(handle_notify), pattern='^(Approve|Reject) [0-9]+$'))
+    application.add_handler(CommandHandler("pending", metrics.handler(handle_pending)))
+    application.add_handler(CallbackQueryHandler(
+        metrics.handler(handle_bulk), pattern='^Bulk (Toggle [0-9]+|Page [0-9]+|All|None|Approve|Reject)$'))
+
+    # the background jobs are scheduled once the backends are connected
+    scheduler.init(application, configs, scheduler.STATE_FILE if primary else "jobs.{}.json".format(index))
+    timings["build"] = time.perf_counter() - started
+    return application
+
+
+def start_jobs(index: int, count: int) -> None:
+    """Schedules the background jobs"""
+    primary = index == 0
+    scheduler.repeating("purge_cache", cache.purge, configs.get("cache_ttl"))
+    scheduler.repeating("save_conversations", conversations.flush, configs.get("conversation_flush"))
+    sheetWorker.owner = primary
+
+    if primary:
+        # create spreadsheet, and schedule subsequent creation of spreadsheets
+        flushWorker.init(configs, count > 1)
+        rosterWorker.init(configs)
+        reminderWorker.init(configs)
+        sheetWorker.init(configs.get('admin_email'), configs.get('provision_at'))
+    if count > 1:
+        # other workers approve users and record statuses too
+        scheduler.repeating("refresh_snapshot", sheetWorker.refresh_snapshot, configs.get("webhook_refresh"))
+
+
+def build_worker(index: int, count: int) -> Application:
+    """Sets up a webhook worker process, and builds its application"""
+    global bot_token, configs, started
+
+    started = time.perf_counter()
+    logconfig.setup()
+    configs = config.read()
+    logconfig.configure(configs)
+    bot_token = configs.get("bot_token")
 
-    # create spreadsheet, and schedule subsequent creation of spreadsheets
-    ggsheets.connect()
-    sheetWorker.init(configs.get('admin_email'))
+    # the outbound message and incoming update budgets are shared between the workers, and changes made by other
+    # workers are only seen once the cached entries expire
+    configs["global_rate"] /= count
+    configs["admission_global_rate"] /= count
+    configs["cache_ttl"] = min(configs.get("cache_ttl"), configs.get("webhook_refresh"))
+
+    cache.configure(configs)
+    return build(index, count)
+
+
+def main() -> None:
+    """Starts the bot."""
+    global bot_token, drive_token, configs, started
+
+    # read the config file, and set up logging
+    started = time.perf_counter()
+    logconfig.setup()
+    configs = config.read()
+    logconfig.configure(configs)
+    bot_token = configs.get("bot_token")
+    drive_token = configs.get("drive_token")
+
+    # receive updates by webhook, and process them in several worker processes, once the schema is up to date
+    if configs.get("webhook_enabled"):
+        db.connect(configs)
+        try:
+            migrations.migrate()
+        except Exception as e:
+            logger.exception(e)
+            exit(1)
+        db.close()
+        healthy = webhook.run(configs, build_worker)
+        logconfig.stop()
+        if not healthy:
+            exit(1)
+        return
+
+    # the database and Google Sheets are connected in the background once updates are being taken, see startup()
+    cache.configure(configs)
+    application = build()
 
     # poll for updates
     application.run_polling()
@@ -0,0 +1,212 @@
+"""
+Class for collecting latency histograms and counters, served in the Prometheus text format.
+
+Metrics are off unless [Metrics] ENABLED is set. When they are off, handlers are registered unwrapped and the
+database, Sheets and scheduler hooks are left unset, so nothing is measured and nothing is paid for.
+
+Author: eliaise
+"""
+import logging
+import re
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+enabled = False
+server = None
+
+
+class Histogram:
+    """Latency histogram with one series per label value"""
+
+    def __init__(self, name: str, documentation: str, label: str):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.series = {}    # label value -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value: str, seconds: float) -> None:
+        with self.lock:
+            series = self.series.get(value)
+            if series is None:
+                series = self.series[value] = [0] * (len(BUCKETS) + 2)
+            for position, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[position] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} histogram".format(self.name)]
+        with self.lock:
+            for value, series in sorted(self.series.items()):
+                label = '{}="{}"'.format(self.label, escape(value))
+                for position, bound in enumerate(BUCKETS):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, label, bound, series[position]))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(self.name, label, series[-1]))
+                lines.append("{}_sum{{{}}} {}".format(self.name, label, series[-2]))
+                lines.append("{}_count{{{}}} {}".format(self.name, label, series[-1]))
+        return lines
+
+
+class Counter:
+    """Counter with one series per label value"""
+
+    def __init__(self, name: str, documentation: str, label: str):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.series = {}    # label value -> count
+        self.lock = threading.Lock()
+
+    def inc(self, value: str, amount: float = 1) -> None:
+        with self.lock:
+            self.series[value] = self.series.get(value, 0) + amount
+
+    def render(self) -> list:
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} counter".format(self.name)]
+        with self.lock:
+            for value, count in sorted(self.series.items()):
+                lines.append('{}{{{}="{}"}} {}'.format(self.name, self.label, escape(value), count))
+        return lines
+
+
+handler_seconds = Histogram("attendance_handler_seconds", "Time taken by the bot's handlers.", "handler")
+handler_errors = Counter("attendance_handler_errors_total", "Exceptions raised by the bot's handlers.", "handler")
+query_seconds = Histogram("attendance_db_query_seconds", "Time taken by database statements.", "statement")
+query_errors = Counter("attendance_db_query_errors_total", "Database statements which failed.", "statement")
+sheets_seconds = Histogram("attendance_sheets_request_seconds", "Time taken by Google Sheets requests.", "method")
+sheets_errors = Counter("attendance_sheets_request_errors_total", "Google Sheets requests which failed.", "method")
+sheets_throttle = Counter("attendance_sheets_throttle_seconds_total",
+                          "Time spent waiting for the Google Sheets request budget.", "method")
+job_seconds = Histogram("attendance_job_seconds", "Time taken by scheduled jobs.", "job")
+job_skipped = Counter("attendance_job_skipped_total", "Job runs skipped because the job was still running.", "job")
+
+METRICS = [handler_seconds, handler_errors, query_seconds, query_errors, sheets_seconds, sheets_errors,
+           sheets_throttle, job_seconds, job_skipped]
+
+gauges = []         # functions returning {(metric name, label, label value): value}, read on every scrape
+
+
+def escape(value: str) -> str:
+    """Escapes a label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def statement(stmt: str) -> str:
+    """Turns a statement into a label, collapsing whitespace and lists of placeholders"""
+    stmt = re.sub(r"\s+", " ", stmt).strip()
+    return re.sub(r"%s(, %s)+", "%s, ...", stmt)
+
+
+def handler(func):
+    """Wraps a handler so that its latency and errors are recorded. Returns the handler untouched if disabled."""
+    if not enabled:
+        return func
+
+    name = func.__name__
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def observe_query(stmt: str, seconds: float, failed: bool) -> None:
+    """Hook for the database layer"""
+    label = statement(stmt)
+    query_seconds.observe(label, seconds)
+    if failed:
+        query_errors.inc(label)
+
+
+def observe_sheets(method: str, seconds: float, throttle: float, failed: bool) -> None:
+    """Hook for the Google Sheets layer"""
+    sheets_seconds.observe(method, seconds)
+    if throttle:
+        sheets_throttle.inc(method, throttle)
+    if failed:
+        sheets_errors.inc(method)
+
+
+def observe_job(name: str, seconds: float, skipped: bool) -> None:
+    """Hook for the scheduler"""
+    if skipped:
+        job_skipped.inc(name)
+    else:
+        job_seconds.observe(name, seconds)
+
+
+def render() -> str:
+    """Returns every metric in the Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+
+    for gauge in gauges:
+        try:
+            values = gauge()
+        except Exception as e:
+            logger.exception(e)
+            continue
+        for (name, label, value), amount in sorted(values.items()):
+            lines.append('{}{{{}="{}"}} {}'.format(name, label, escape(value), amount))
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the metrics on /metrics"""
+
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        # scrapes are too frequent to log
+        pass
+
+
+def init(configs: dict) -> bool:
+    """Turns metrics on if configured, and starts serving them. Returns whether metrics are enabled."""
+    global enabled, server
+
+    enabled = configs.get("metrics_enabled", False)
+    if not enabled:
+        return False
+
+    host = configs.get("metrics_host") or "127.0.0.1"
+    port = configs.get("metrics_port") or 9100
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return True
+
+
+def shutdown() -> None:
+    """Stops serving the metrics"""
+    if server:
+        server.shutdown()
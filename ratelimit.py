@@ -0,0 +1,52 @@
+"""
+Class for limiting the rate of requests with token buckets.
+
+Author: eliaise
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Bucket which fills up with `rate` tokens per second, up to `capacity` tokens.
+
+    Taking a token when the bucket is empty reserves the next token to come in, so that callers can wait for their
+    turn instead of polling.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def reserve(self) -> float:
+        """Takes a token, returning the number of seconds to wait before it may be used"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def try_take(self) -> bool:
+        """Takes a token if one is available right now"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def full(self) -> bool:
+        """Whether the bucket has filled back up, i.e. it has not been used for a while"""
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
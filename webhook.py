@@ -0,0 +1,230 @@
+"""
+Class for receiving updates from Telegram by webhook, and spreading them over several worker processes.
+
+Telegram posts every update to a local HTTP receiver (behind a reverse proxy terminating TLS). The receiver hashes
+the user id of the update to pick one of N worker processes, and hands the raw update to that worker's queue. Each
+worker runs its own Application and processes its updates one at a time, as run_polling would. A user's updates
+always land on the same worker, so their conversation state stays in one place while the workers use all the cores.
+
+Worker 0 owns the spreadsheet: it creates the daily worksheet, replicates the ledger to it, and handles the commands
+in PRIMARY_COMMANDS, which rewrite the whole worksheet.
+
+The workers ignore SIGINT and SIGTERM, which a service manager sends to the whole process group. The receiver stops
+them instead, once it has stopped taking updates, so that they finish the updates already queued and flush what
+they hold before exiting. If a worker exits on its own, e.g. because it could not reach the backends, the updates
+of its users are refused so that Telegram retries them, and the receiver stops every worker and exits with an error
+for the service manager to restart it.
+
+Author: eliaise
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from telegram import Bot, Update
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+READY_TIMEOUT = 60      # seconds to wait for the workers to start
+
+# commands handled by worker 0, whoever sends them
+PRIMARY_COMMANDS = ("/resync",)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def user_of(update: dict):
+    """Returns the id of the user who sent the update, or of the chat it came from. None if there is neither."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user.get("id")
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+
+def shard(update: dict, workers: int) -> int:
+    """Returns the worker which should process the update"""
+    text = (update.get("message") or {}).get("text") or ""
+    if text.split(" ", 1)[0].split("@", 1)[0] in PRIMARY_COMMANDS:
+        return 0
+
+    user_id = user_of(update)
+    return user_id % workers if user_id else 0
+
+
+class Receiver(BaseHTTPRequestHandler):
+    """Accepts the updates posted by Telegram, and queues each one for its worker, if it is still running"""
+
+    protocol_version = "HTTP/1.1"   # keep-alive, Telegram holds its connections open
+
+    path_expected = "/"
+    secret = None
+    workers = []    # (queue, process) of every worker
+
+    def do_POST(self) -> None:
+        if self.path != self.path_expected:
+            self.reply(404)
+            return
+        if self.secret and self.headers.get(SECRET_HEADER) != self.secret:
+            self.reply(403)
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self.reply(400)
+            return
+
+        updates, process = self.workers[shard(update, len(self.workers))]
+        if not process.is_alive():
+            # Telegram retries the update later
+            self.reply(503)
+            return
+
+        updates.put(body)
+        self.reply(200)
+
+    def reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args) -> None:
+        # one line per update is too many to log
+        pass
+
+
+def _work(index: int, count: int, updates, ready, build) -> None:
+    """Entry point of a worker process"""
+    # the receiver tells the worker when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_consume(index, count, updates, ready, build))
+
+
+async def _consume(index: int, count: int, updates, ready, build) -> None:
+    """Builds the worker's application, and processes the updates queued for it until told to stop"""
+    application = build(index, count)
+    application.bot_data["stop"] = partial(updates.put, None)   # called if the worker cannot start, see main.warm_up
+    application.bot_data["backlog"] = updates.qsize     # updates are taken from this queue, see admission.py
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    ready.set()
+
+    loop = asyncio.get_running_loop()
+    processed = 0
+    try:
+        while True:
+            body = await loop.run_in_executor(None, updates.get)
+            if body is None:
+                break
+            update = Update.de_json(json.loads(body), application.bot)
+            await application.process_update(update)
+            processed += 1
+    finally:
+        logger.info("Worker %s processed %s updates.", index, processed)
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+
+def start(count: int, build) -> list:
+    """
+    Starts the worker processes, and waits for them to be ready.
+
+    build is called with (worker index, worker count) in each worker, and returns the worker's Application. It must be
+    a module-level function, since the workers are spawned rather than forked.
+
+    Returns the (queue, process) of every worker.
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for index in range(count):
+        updates = context.Queue()
+        ready = context.Event()
+        process = context.Process(target=_work, args=(index, count, updates, ready, build),
+                                  name="worker-{}".format(index))
+        process.start()
+        workers.append((updates, process, ready))
+
+    for index, (_, process, ready) in enumerate(workers):
+        if not ready.wait(READY_TIMEOUT):
+            logger.error("Worker %s did not start within %s seconds.", index, READY_TIMEOUT)
+
+    logger.info("Started %s workers.", count)
+    return [(updates, process) for updates, process, _ in workers]
+
+
+def stop(workers: list) -> None:
+    """Lets the workers finish the updates already queued, and waits for them to exit"""
+    for updates, _ in workers:
+        updates.put(None)
+    for _, process in workers:
+        process.join()
+
+
+def serve(host: str, port: int, path: str, secret: str, workers: list) -> ThreadingHTTPServer:
+    """Starts receiving updates in a background thread, for the (queue, process) workers"""
+    handler = type("BoundReceiver", (Receiver,), {"path_expected": path, "secret": secret, "workers": workers})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+    logger.info("Receiving updates on http://%s:%s%s", host, port, path)
+    return server
+
+
+async def set_webhook(token: str, url: str, secret: str) -> None:
+    """Tells Telegram where to post the updates"""
+    async with Bot(token) as bot:
+        await bot.set_webhook(url, secret_token=secret)
+    logger.info("Webhook set to %s.", url)
+
+
+def run(configs: dict, build) -> bool:
+    """
+    Registers the webhook with Telegram, and receives updates for the workers until interrupted or terminated, or
+    until a worker exits on its own.
+
+    Returns whether every worker was still running when told to stop.
+    """
+    count = configs.get("webhook_workers") or DEFAULT_WORKERS
+    url = configs.get("webhook_url")
+    secret = configs.get("webhook_secret") or None
+
+    workers = start(count, build)
+    server = serve(configs.get("webhook_host") or "127.0.0.1", configs.get("webhook_port") or 8443,
+                   urlparse(url).path or "/", secret, workers)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    healthy = True
+
+    try:
+        asyncio.run(set_webhook(configs.get("bot_token"), url, secret))
+        while healthy and not stopping.wait(1):
+            exited = [index for index, (_, process) in enumerate(workers) if not process.is_alive()]
+            if exited:
+                logger.error("Worker %s exited, stopping every worker.", exited)
+                healthy = False
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Stopping the webhook receiver.")
+        server.shutdown()
+        stop(workers)
+    return healthy
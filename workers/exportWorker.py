@@ -0,0 +1,112 @@
+"""
+Worker class to export the attendance ledger over a range of days, as CSV or as an Excel workbook.
+
+Rows are streamed from the ledger in chunks and written out as they arrive, so the memory used stays the same however
+long the range is. Workbooks are written in openpyxl's write-only mode, which also streams its rows to disk. Only the
+statuses which were given are exported, one row per user per day.
+
+Run from the repository root:
+    python -m workers.exportWorker attendance.csv 2026-01-01 2026-12-31 --department IT
+
+Author: eliaise
+"""
+
+import argparse
+import csv
+import io
+import logging
+import time
+from datetime import datetime
+
+import config
+import logconfig
+from connectors import db
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "xlsx")
+HEADER = ["Date", "Department", "Title", "Name", "Status"]
+CHUNK_SIZE = 5000       # ledger rows read at a time
+
+SELECT_ROWS = "SELECT a.date, u.department, u.title, u.name, a.status FROM attendance a " \
+              "JOIN users u ON u.userId = a.userId " \
+              "WHERE a.date BETWEEN %s AND %s AND a.status IS NOT NULL{} " \
+              "ORDER BY a.date, u.department, u.title, u.name"
+
+
+def rows(start, end, department: str = None):
+    """Yields the chunks of (date, department, title, name, status) rows of the range, of the department or of all"""
+    stmt = SELECT_ROWS.format(" AND u.department = %s" if department else "")
+    variables = (start.isoformat(), end.isoformat()) + ((department,) if department else ())
+    yield from db.stream_sync(stmt, variables, CHUNK_SIZE)
+
+
+def write_csv(chunks, file) -> int:
+    """Writes the chunks to the open binary file as UTF-8 CSV. Returns the number of rows written."""
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        writer = csv.writer(text)
+        writer.writerow(HEADER)
+        written = 0
+        for chunk in chunks:
+            writer.writerows(chunk)
+            written += len(chunk)
+        return written
+    finally:
+        # leave the file open for the caller
+        text.flush()
+        text.detach()
+
+
+def write_xlsx(chunks, file) -> int:
+    """Writes the chunks to the open binary file as an Excel workbook. Returns the number of rows written."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Attendance")
+    sheet.append(HEADER)
+    written = 0
+    for chunk in chunks:
+        for row in chunk:
+            sheet.append(row)
+        written += len(chunk)
+    workbook.save(file)
+    return written
+
+
+def export(file, start, end, department: str = None, form: str = "csv") -> int:
+    """Writes the attendance of the range to the open binary file in the given format. Returns the rows written."""
+    began = time.perf_counter()
+    writer = write_xlsx if form == "xlsx" else write_csv
+    written = writer(rows(start, end, department), file)
+    logger.info("Exported %s rows of %s to %s as %s in %.2fs.", written, department or "all departments", start, end,
+                form, time.perf_counter() - began)
+    return written
+
+
+def main() -> None:
+    """Exports the attendance from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="file to write, as CSV unless it ends in .xlsx")
+    parser.add_argument("start", help="first day, e.g. 2026-01-01")
+    parser.add_argument("end", help="last day, e.g. 2026-12-31")
+    parser.add_argument("--department", help="only this department")
+    args = parser.parse_args()
+
+    logconfig.setup()
+    configs = config.read()
+    logconfig.configure(configs)
+    db.connect(configs)
+
+    with open(args.file, "wb") as file:
+        written = export(file, datetime.strptime(args.start, "%Y-%m-%d").date(),
+                         datetime.strptime(args.end, "%Y-%m-%d").date(), args.department,
+                         "xlsx" if args.file.endswith(".xlsx") else "csv")
+    print("Exported {} rows to {}.".format(written, args.file))
+
+    db.close()
+    logconfig.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Worker class to replicate the attendance ledger to the spreadsheet in the background.
+
+Statuses are recorded in the ledger as soon as they are given. The rows which changed since they were last synced
+are written to today's worksheet every FLUSH_INTERVAL seconds, as soon as FLUSH_SIZE changes are waiting, and once
+more when the bot shuts down. Rows which could not be written stay unsynced and are retried on the next run. Rows of
+the previous day which were still unsynced at midnight are written when the worksheet rolls over.
+
+With webhook workers, statuses are recorded by every worker but only the one owning the spreadsheet replicates them,
+so it reads the ledger on every run instead of waiting to be told of changes.
+
+Author: eliaise
+"""
+
+import logging
+from datetime import date
+
+from connectors import ggsheets, ledger, snapshot
+from workers import scheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 5    # seconds
+DEFAULT_SIZE = 50       # changes
+
+JOB_NAME = "flush"
+
+size = DEFAULT_SIZE
+scheduled = False       # whether this process replicates the ledger, only one webhook worker does
+dirty = True            # whether the ledger may have unsynced rows, set on startup to catch up after a restart
+poll = False            # whether the ledger is read on every run, as other processes record statuses too
+changes = 0             # changes submitted since the last run
+
+
+def submit(user_id, status: str) -> None:
+    """Notes a status change recorded in the ledger, syncing straight away if enough changes are waiting."""
+    global dirty, changes
+
+    if not scheduled:
+        return
+
+    dirty = True
+    changes += 1
+    if changes >= size:
+        scheduler.trigger(JOB_NAME)
+
+
+def replicate() -> int:
+    """
+    Writes the rows of today's ledger which changed since they were last synced to the worksheet.
+
+    Returns the number of statuses written.
+    """
+    global dirty, changes
+
+    if not dirty and not poll:
+        return 0
+
+    # cleared before reading, so that changes recorded during the sync are picked up by the next run
+    dirty = False
+    changes = 0
+
+    day = date.today()
+    rows = ledger.unsynced(day)
+    if rows is None:
+        dirty = True
+        return 0
+    if not rows:
+        return 0
+
+    try:
+        written = set(ggsheets.write_statuses([(user_id, status) for user_id, status, _ in rows]))
+    except Exception as e:
+        logger.exception(e)
+        dirty = True
+        return 0
+
+    if not ledger.mark_synced(day, [(user_id, version) for user_id, _, version in rows if user_id in written]):
+        dirty = True
+    if len(written) < len(rows):
+        # users without a row yet, e.g. before today's worksheet is loaded, are tried again on the next run
+        dirty = True
+    return len(written)
+
+
+def resync(day: date) -> int:
+    """
+    Rebuilds the day's worksheet from the ledger in a single bulk write, e.g. after a Sheets outage.
+
+    Returns the number of rows written.
+    """
+    global dirty
+
+    # the versions are read first, so that a status changed in between is written again by the next run
+    versions = ledger.versions(day)
+    rows = ledger.roster(day)
+    if rows is None or versions is None:
+        raise RuntimeError("Failed to read the ledger of {}.".format(day))
+
+    rows = [list(row) for row in rows]
+    # rows are not written or moved by other job threads while the worksheet is replaced
+    with ggsheets.rows_lock:
+        ggsheets.rewrite(day, rows)
+        if not ledger.mark_synced(day, versions):
+            logger.error("Failed to mark the rows of %s as synced, they will be written again.", day)
+            dirty = True
+
+        if day == date.today():
+            ggsheets.load(rows)
+            snapshot.load(rows)
+    return len(rows)
+
+
+def catch_up(day: date) -> int:
+    """
+    Rebuilds the day's worksheet if any of its rows were left unsynced, e.g. statuses given just before midnight.
+
+    Returns the number of rows written.
+    """
+    rows = ledger.unsynced(day)
+    if not rows:
+        return 0
+
+    logger.info("Catching up on %s unsynced status changes of %s.", len(rows), day)
+    return resync(day)
+
+
+def init(configs: dict, shared: bool = False) -> None:
+    """Schedules the periodic sync. shared is whether other processes record statuses too."""
+    global size, scheduled, poll
+
+    interval = configs.get("flush_interval") or DEFAULT_INTERVAL
+    size = configs.get("flush_size") or DEFAULT_SIZE
+
+    logger.info("Syncing status changes every %s seconds or %s changes.", interval, size)
+    scheduler.repeating(JOB_NAME, replicate, interval)
+    scheduled = True
+    poll = shared
+
+
+async def stop() -> None:
+    """Writes whatever is left unsynced."""
+    if not scheduled:
+        return
+
+    written = await scheduler.run_blocking(replicate)
+    logger.info("Synced %s remaining status changes.", written)
@@ -0,0 +1,148 @@
+"""
+Worker class to import a roster of users from a CSV file, for onboarding a whole intake at once.
+
+Each row is (userId, name, title, department, role), with an optional header. The file is streamed: rows are
+validated as they are read, and the valid ones are inserted as approved users in chunks, all within one transaction.
+The users are then queued for the roster worker, which adds them to today's worksheet in a single batch update.
+
+Run from the repository root, while the bot is stopped:
+    python -m workers.importWorker roster.csv --sheet
+
+While the bot is running, send the file to the bot with /import as its caption instead, so that the bot's copy of
+the worksheet stays in step.
+
+Author: eliaise
+"""
+
+import argparse
+import csv
+import logging
+import time
+from re import search
+
+import config
+import constants
+import logconfig
+from connectors import db, ggsheets, cache
+from workers import sheetWorker, rosterWorker
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+ROLES = ("User", "IC", "Admin")
+
+# imported users are approved straight away, and in a private chat the chat id is the user id
+UPSERT = "INSERT INTO users (userId, chatId, name, title, department, role, accStatus) " \
+         "VALUES (%s, %s, %s, %s, %s, %s, 1) " \
+         "ON DUPLICATE KEY UPDATE name = VALUES(name), title = VALUES(title), department = VALUES(department), " \
+         "role = VALUES(role), accStatus = 1"
+
+
+def validate(row: list):
+    """Returns the row as it is to be inserted, or the reason it was rejected"""
+    if len(row) != 5:
+        return "expected 5 columns, got {}".format(len(row))
+
+    user_id, name, title, department, role = [value.strip() for value in row]
+    title = title.upper()
+    if not user_id.isdigit():
+        return "invalid user id"
+    if not search(constants.REGEX_NAME, name):
+        return "invalid name"
+    if not search(constants.REGEX_TITLE, title):
+        return "invalid title"
+    if not search(constants.REGEX_DEPARTMENT, department):
+        return "invalid department"
+    if role not in ROLES:
+        return "invalid role"
+
+    return int(user_id), int(user_id), name, title, department, role
+
+
+def import_roster(file, sheet: bool = True) -> dict:
+    """
+    Imports the users in the open CSV file.
+
+    With sheet, today's worksheet is brought up to date with the users straight away. Otherwise the worker owning the
+    sheet picks them up on its next sync. Returns a report of the number of rows
+    imported, the (line, reason) of every rejected row, and the time taken. Database errors are raised, in which case
+    nothing is imported.
+    """
+    start = time.perf_counter()
+    imported = []
+    rejected = []
+
+    def chunks():
+        chunk = []
+        for line, row in enumerate(csv.reader(file), start=1):
+            if not row or (line == 1 and not row[0].strip().isdigit()):
+                # blank line, or the header
+                continue
+
+            result = validate(row)
+            if isinstance(result, str):
+                rejected.append((line, result))
+                continue
+
+            chunk.append(result)
+            if len(chunk) == CHUNK_SIZE:
+                yield chunk
+                imported.extend(chunk)
+                chunk = []
+        if chunk:
+            yield chunk
+            imported.extend(chunk)
+
+    db.run_chunks_sync(UPSERT, chunks())
+    for user_id, *_ in imported:
+        cache.users.invalidate(user_id)
+    cache.departments.invalidate()
+
+    rosterWorker.changed_sync(list(dict.fromkeys(user_id for user_id, *_ in imported)))
+    added = 0
+    if sheet and ggsheets.values is not None:
+        added = rosterWorker.sync().get("appended", 0)
+
+    elapsed = time.perf_counter() - start
+    logger.info("Imported %s users in %.2fs, rejected %s rows, added %s to the sheet.",
+                len(imported), elapsed, len(rejected), added)
+    return {"imported": len(imported), "rejected": rejected, "added": added, "seconds": elapsed}
+
+
+def summary(report: dict, limit: int = 20) -> str:
+    """Describes the report, listing up to limit rejected rows"""
+    rate = report["imported"] / report["seconds"] if report["seconds"] else 0
+    lines = ["Imported {} users in {:.2f}s ({:.0f} rows/s), {} added to today's sheet. {} rows rejected.".format(
+        report["imported"], report["seconds"], rate, report["added"], len(report["rejected"]))]
+    lines += ["Line {}: {}".format(line, reason) for line, reason in report["rejected"][:limit]]
+    if len(report["rejected"]) > limit:
+        lines.append("... and {} more.".format(len(report["rejected"]) - limit))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    """Imports a roster from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="CSV of userId, name, title, department, role")
+    parser.add_argument("--sheet", action="store_true", help="also add the users to today's worksheet")
+    args = parser.parse_args()
+
+    logconfig.setup()
+    configs = config.read()
+    logconfig.configure(configs)
+    db.connect(configs)
+
+    if args.sheet:
+        ggsheets.connect()
+        sheetWorker.create_sheet(configs.get("admin_email"))
+
+    with open(args.file, newline="") as file:
+        report = import_roster(file, args.sheet)
+    print(summary(report, limit=len(report["rejected"])))
+
+    db.close()
+    logconfig.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Worker class to remind the users who have not given their status for the day.
+
+Every user on the day's roster is given a position, and the users of each department and those who have given their
+status are kept as bitsets over those positions, held in Python ints. A sweep reads the roster and the day's
+reporters in two queries, finds everyone still missing with a single mask operation, and queues their reminders in
+batches through the send worker at bulk priority, so that they never hold up other messages. Reporters are remembered
+for the rest of the day, so later sweeps only reach those who are still missing.
+
+Author: eliaise
+"""
+
+import asyncio
+import logging
+import time
+from datetime import date, datetime
+
+from connectors import db
+from workers import scheduler, sendWorker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH = 100
+MESSAGE = "You have not given your status for today. Use /update followed by your status, e.g. /update Present"
+
+ROSTER = "SELECT userId, chatId, department FROM users WHERE accStatus = 1"
+REPORTED = "SELECT userId FROM attendance WHERE date = %s AND status IS NOT NULL"
+
+batch = DEFAULT_BATCH
+day = None
+positions = {}      # userId -> position of the user in the bitsets
+chats = []          # chatId of the user at each position
+active = 0          # users on the roster
+departments = {}    # department -> its users on the roster
+reported = 0        # users who have given their status today
+
+
+def mask(bits) -> int:
+    """Returns the bitset with the given positions set"""
+    bits = list(bits)
+    if not bits:
+        return 0
+    buffer = bytearray(max(bits) // 8 + 1)
+    for position in bits:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def members(bitset: int):
+    """Yields the positions set in the bitset"""
+    bits = bin(bitset)[:1:-1]   # least significant bit first
+    position = bits.find("1")
+    while position != -1:
+        yield position
+        position = bits.find("1", position + 1)
+
+
+def count(bitset: int) -> int:
+    """Returns the number of positions set in the bitset"""
+    return bin(bitset).count("1")
+
+
+async def load(today: date) -> bool:
+    """Brings the roster and the reporters up to date. Returns False if the database could not be read."""
+    global day, positions, chats, active, departments, reported
+
+    roster = await db.run_select(ROSTER, None)
+    reporters = await db.run_select(REPORTED, (today.isoformat(),))
+    if roster is None or reporters is None:
+        return False
+
+    if today != day:
+        day = today
+        positions = {}
+        chats = []
+        reported = 0
+
+    # positions are kept for the day, users approved since the last sweep are given new ones
+    grouped = {}
+    for user_id, chat_id, department in roster:
+        position = positions.get(user_id)
+        if position is None:
+            position = positions[user_id] = len(chats)
+            chats.append(chat_id)
+        else:
+            chats[position] = chat_id
+        grouped.setdefault(department, []).append(position)
+
+    departments = {department: mask(bits) for department, bits in grouped.items()}
+    active = mask(position for bits in grouped.values() for position in bits)
+    reported |= mask(positions[user_id] for user_id, in reporters if user_id in positions)
+    return True
+
+
+def missing(selected: list = None) -> int:
+    """Returns the bitset of the users on the roster who have not given their status, of the selected departments"""
+    users = active
+    if selected:
+        users = 0
+        for department in selected:
+            users |= departments.get(department, 0)
+    return users & ~reported
+
+
+def missing_by_department() -> dict:
+    """Returns the number of users of each department who have not given their status"""
+    return {department: count(users & ~reported) for department, users in departments.items()}
+
+
+async def sweep(selected: list = None) -> int:
+    """
+    Reminds the users of the selected departments, or of every department, who have not given their status today.
+
+    Returns the number of reminders sent.
+    """
+    start = time.perf_counter()
+    if not await load(date.today()):
+        logger.error("Failed to read the roster, no reminders were sent.")
+        return 0
+
+    chat_ids = [chats[position] for position in members(missing(selected))]
+    sent = 0
+    for offset in range(0, len(chat_ids), batch):
+        futures = [sendWorker.send(chat_id, MESSAGE, priority=sendWorker.BULK)
+                   for chat_id in chat_ids[offset:offset + batch]]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        sent += sum(1 for result in results if not isinstance(result, Exception))
+
+    logger.info("Reminder sweep of %s users took %.2fs, sent %s of %s reminders.",
+                count(active), time.perf_counter() - start, sent, len(chat_ids))
+    return sent
+
+
+def init(configs: dict) -> None:
+    """Schedules the reminder sweeps."""
+    global batch
+
+    batch = configs.get("reminder_batch") or DEFAULT_BATCH
+    selected = configs.get("reminder_departments") or None
+    times = configs.get("reminder_times") or []
+    # only the latest sweep missed today is caught up, so that no one is reminded twice at once after a restart
+    now = datetime.now().time()
+    latest = max((at for at in times if at <= now), default=None)
+    for at in times:
+        scheduler.daily("remind_{:%H%M}".format(at), lambda: sweep(selected), at, blocking=False,
+                        catch_up=at == latest)
@@ -0,0 +1,139 @@
+"""
+Worker class to keep today's worksheet in step with the users table.
+
+Whenever users are approved, rejected, removed or imported, their ids are recorded in the roster_changes table. The
+worker owning the spreadsheet reads the queued ids, looks up only those users, and brings their rows on the worksheet
+in line with the database in a single batch update, so that the cost of a sync grows with the number of changes
+rather than the size of the roster. The queue is kept in the database so that changes made by any webhook worker, or
+by an import from the command line, reach the worksheet.
+
+The queue is drained straight after a change made in this process, and every ROSTER_INTERVAL seconds otherwise, as
+set in the [Google] section of the configuration file.
+
+Author: eliaise
+"""
+
+import logging
+from datetime import date
+
+import constants
+from connectors import db, ggsheets, snapshot
+from workers import scheduler, flushWorker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60   # seconds
+CHUNK_SIZE = 500        # users looked up per query
+
+JOB_NAME = "sync_roster"
+
+QUEUE = "INSERT INTO roster_changes (userId) VALUES (%s)"
+SELECT_QUEUED = "SELECT id, userId FROM roster_changes ORDER BY id"
+DELETE_QUEUED = "DELETE FROM roster_changes WHERE id <= %s"
+SELECT_USERS = "SELECT u.userId, u.title, u.name, u.department, u.accStatus, a.status FROM users u " \
+               "LEFT JOIN attendance a ON a.userId = u.userId AND a.date = %s WHERE u.userId IN ({})"
+
+scheduled = False       # whether this process writes the roster to the spreadsheet, only one webhook worker does
+
+
+async def changed(user_ids: list) -> None:
+    """Queues the users whose rows may need to change, and syncs straight away if this process owns the sheet"""
+    if not await db.run_many(QUEUE, [(user_id,) for user_id in user_ids]):
+        logger.error("Failed to queue roster changes of %s users.", len(user_ids))
+        return
+
+    if scheduled:
+        scheduler.trigger(JOB_NAME)
+
+
+def changed_sync(user_ids: list) -> None:
+    """Queues the users whose rows may need to change, from outside the event loop"""
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        if not db.run_many_sync(QUEUE, [(user_id,) for user_id in user_ids[start:start + CHUNK_SIZE]]):
+            logger.error("Failed to queue roster changes of %s users.", len(user_ids))
+            return
+
+
+def lookup(user_ids: list) -> dict:
+    """
+    Returns the row (userId, title, name, department, status) of each of the users who should be on the worksheet,
+    with their status of the day if they already gave one, and None for those who should not, i.e. who are not
+    approved or no longer exist.
+    """
+    users = dict.fromkeys(user_ids)
+    today = date.today().isoformat()
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = user_ids[start:start + CHUNK_SIZE]
+        result = db.run_select_sync(SELECT_USERS.format(", ".join(["%s"] * len(chunk))), (today,) + tuple(chunk))
+        if result is None:
+            raise RuntimeError("Failed to look up {} users.".format(len(chunk)))
+        for user_id, title, name, department, acc_status, status in result:
+            if acc_status == 1:
+                users[user_id] = (user_id, title, name, department, status)
+    return users
+
+
+def apply(users: dict) -> dict:
+    """Writes the users' rows to today's worksheet, and updates the attendance snapshot to match"""
+    result = ggsheets.sync_roster(users)
+    if result is None:
+        return None
+    counts, synced = result
+    if not any(counts.values()):
+        return counts
+
+    if counts["appended"]:
+        # statuses given before the users' rows existed were skipped, and are still unsynced in the ledger
+        flushWorker.dirty = True
+
+    # only the users whose rows changed, with their statuses in the ledger rather than the cached ones on the worksheet
+    snapshot.remove([user_id for user_id, row in users.items() if row is None])
+    snapshot.update([users[user_id] for user_id in synced])
+    return counts
+
+
+def sync() -> dict:
+    """
+    Syncs the rows of the queued users to today's worksheet.
+
+    Returns the number of rows appended, updated and removed. The queue is kept if today's worksheet is not loaded
+    yet or the sync fails, and retried on the next run.
+    """
+    queued = db.run_select_sync(SELECT_QUEUED, None)
+    if not queued or ggsheets.values is None:
+        return {}
+
+    last = max(change_id for change_id, _ in queued)
+    user_ids = list(dict.fromkeys(user_id for _, user_id in queued))
+    counts = apply(lookup(user_ids))
+    if counts is None:
+        return {}
+
+    db.run_update_sync(DELETE_QUEUED, (last,))
+    logger.info("Synced the rows of %s users: %s.", len(user_ids), counts)
+    return counts
+
+
+def sync_all() -> dict:
+    """
+    Compares every approved user with today's worksheet, e.g. once a new day's worksheet built in advance is switched
+    to. No requests are made to Google Sheets unless rows need to change.
+    """
+    result = db.run_select_sync(constants.SELECT_ACTIVE_USERS, None)
+    if result is None:
+        raise RuntimeError("Failed to retrieve data for all users.")
+
+    users = {row[0]: tuple(row[:5]) for row in result}
+    active = {str(user_id) for user_id in users}
+    users.update((user_id, None) for user_id in ggsheets.index if user_id not in active)
+    return apply(users)
+
+
+def init(configs: dict) -> None:
+    """Schedules the periodic sync."""
+    global scheduled
+
+    interval = configs.get("roster_interval") or DEFAULT_INTERVAL
+    logger.info("Syncing roster changes every %s seconds.", interval)
+    scheduler.repeating(JOB_NAME, sync, interval)
+    scheduled = True
@@ -0,0 +1,181 @@
+"""
+Worker class to run periodic jobs on the bot's job queue.
+
+Blocking jobs are handed to a bounded thread pool so that the Sheets and database calls they make never stall the
+event loop. A job is never run twice at the same time: a run that comes due while the previous one is still going
+is skipped. Each run is timed, and the time of the last successful run of every daily job is saved so that a run
+missed earlier in the day while the bot was down can be caught up on startup.
+
+Author: eliaise
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 4
+STATE_FILE = "jobs.json"
+
+application = None
+executor = None     # threads for blocking jobs
+state_path = None   # where the time of the last run of each job is saved
+last_runs = {}      # daily job name -> timestamp of the last successful run
+jobs = {}           # job name -> details and statistics of the job
+observer = None     # called with (job name, seconds, skipped) after every run, when metrics are enabled
+
+
+async def run_blocking(func, *args):
+    """Runs a blocking function in the job thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+def _load_state() -> None:
+    """Reads the time of the last run of each job"""
+    global last_runs
+
+    try:
+        with open(state_path) as file:
+            last_runs = json.load(file)
+    except FileNotFoundError:
+        last_runs = {}
+    except Exception as e:
+        logger.exception(e)
+        last_runs = {}
+
+
+def _save_state() -> None:
+    """Saves the time of the last run of each job"""
+    try:
+        with open(state_path, "w") as file:
+            json.dump(last_runs, file)
+    except Exception as e:
+        logger.exception(e)
+
+
+def _callback(name: str):
+    """Creates the job queue callback for the job"""
+
+    async def callback(context) -> None:
+        job = jobs[name]
+        if job["running"]:
+            job["skipped"] += 1
+            logger.info("Job %s is still running, skipping this run.", name)
+            if observer:
+                observer(name, 0, True)
+            return
+
+        job["running"] = True
+        start = time.perf_counter()
+        succeeded = False
+        try:
+            if job["blocking"]:
+                await run_blocking(job["func"])
+            else:
+                await job["func"]()
+            succeeded = True
+        except Exception as e:
+            job["failures"] += 1
+            logger.exception(e)
+        finally:
+            elapsed = time.perf_counter() - start
+            job["running"] = False
+            job["runs"] += 1
+            job["total_time"] += elapsed
+            job["last_time"] = elapsed
+
+        logger.info("Job %s took %.3fs.", name, elapsed)
+        if observer:
+            observer(name, elapsed, False)
+        if succeeded and job["daily"]:
+            last_runs[name] = time.time()
+            await run_blocking(_save_state)
+
+    return callback
+
+
+def _register(name: str, func, blocking: bool, daily: bool = False) -> None:
+    """Records a new job"""
+    jobs[name] = {
+        "func": func,
+        "blocking": blocking,
+        "daily": daily,
+        "running": False,
+        "runs": 0,
+        "skipped": 0,
+        "failures": 0,
+        "total_time": 0.0,
+        "last_time": 0.0
+    }
+
+
+def repeating(name: str, func, interval: float, blocking: bool = True) -> None:
+    """Runs the job every interval seconds"""
+    logger.info("Scheduling job %s every %s seconds.", name, interval)
+    _register(name, func, blocking)
+    application.job_queue.run_repeating(_callback(name), interval=interval, first=interval, name=name)
+
+
+def daily(name: str, func, at, blocking: bool = True, catch_up: bool = False, run_now: bool = False) -> None:
+    """
+    Runs the job every day at the given local time.
+
+    catch_up: run the job on startup if its run earlier today was missed, runs missed on previous days are not caught up
+    run_now: run the job on startup regardless
+    """
+    logger.info("Scheduling job %s daily at %s.", name, at)
+    _register(name, func, blocking, daily=True)
+
+    local = datetime.now().astimezone()
+    at = at.replace(tzinfo=local.tzinfo)
+    application.job_queue.run_daily(_callback(name), time=at, days=tuple(range(7)), name=name)
+
+    # find out when the job should last have run
+    due = local.replace(hour=at.hour, minute=at.minute, second=at.second, microsecond=0)
+    if due > local:
+        due -= timedelta(days=1)
+
+    missed = due.date() == local.date() and last_runs.get(name, 0) < due.timestamp()
+    if run_now or (catch_up and missed):
+        if missed:
+            logger.info("Catching up on the missed run of job %s.", name)
+        trigger(name)
+
+
+def trigger(name: str) -> None:
+    """Runs the job as soon as possible"""
+    application.job_queue.run_once(_callback(name), when=0, name=name)
+
+
+def stats() -> dict:
+    """Returns the statistics of every job"""
+    return {
+        name: {key: value for key, value in job.items() if key not in ("func", "blocking", "daily")}
+        for name, job in jobs.items()
+    }
+
+
+def init(app, configs: dict, state_file: str = STATE_FILE) -> None:
+    """Prepares the scheduler. Jobs can be added once this is done."""
+    global application, executor, state_path
+
+    application = app
+    threads = configs.get("worker_threads") or DEFAULT_THREADS
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="job")
+
+    file_path = configs.get("file_path") or "."
+    os.makedirs(file_path, exist_ok=True)
+    state_path = os.path.join(file_path, state_file)
+    _load_state()
+
+
+def shutdown() -> None:
+    """Waits for running blocking jobs to finish"""
+    if executor:
+        executor.shutdown(wait=True)
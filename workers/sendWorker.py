@@ -0,0 +1,137 @@
+"""
+Worker class to send outbound messages through the bot's shared connection.
+
+Messages are queued by priority, so approval prompts go out ahead of bulk broadcasts, and are released within
+Telegram's flood limits: a global token bucket for all chats and one token bucket per chat. A message rejected
+with RetryAfter is sent again once Telegram allows it.
+
+Author: eliaise
+"""
+
+import asyncio
+import itertools
+import logging
+
+from telegram.error import RetryAfter
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# priorities, lower is sent first
+URGENT, NORMAL, BULK = range(3)
+
+DEFAULT_GLOBAL_RATE = 30    # messages per second across all chats
+DEFAULT_CHAT_RATE = 1       # messages per second to one chat
+MAX_ATTEMPTS = 5
+MAX_CHATS = 10000           # per chat buckets kept before idle ones are dropped
+STOP_TIMEOUT = 10           # seconds to wait for the queue to drain on shutdown
+
+bot = None
+queue = None
+order = itertools.count()   # keeps messages of the same priority in order
+global_bucket = None
+chat_buckets = {}           # chatId -> TokenBucket
+chat_locks = {}             # chatId -> asyncio.Lock, keeps the messages to one chat in order
+chat_rate = DEFAULT_CHAT_RATE
+dispatcher = None
+deliveries = set()
+
+
+def send(chat_id: int, text: str, reply_markup=None, priority: int = NORMAL) -> asyncio.Future:
+    """
+    Queues a message. Returns a future which is done once the message has been sent.
+
+    Failures are logged when they happen, so callers which do not wait for the message can drop the future.
+    """
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(_retrieve)
+    message = {"chat_id": chat_id, "text": text, "reply_markup": reply_markup}
+    queue.put_nowait((priority, next(order), message, future))
+    return future
+
+
+def _retrieve(future: asyncio.Future) -> None:
+    """Marks the failure of a message as seen, as it has already been logged"""
+    if not future.cancelled():
+        future.exception()
+
+
+def _chat_bucket(chat_id: int) -> TokenBucket:
+    """Returns the bucket of the chat, dropping the buckets of idle chats if there are too many"""
+    if chat_id not in chat_buckets and len(chat_buckets) >= MAX_CHATS:
+        for idle in [chat for chat, bucket in chat_buckets.items() if bucket.full() and not chat_locks[chat].locked()]:
+            del chat_buckets[idle]
+            del chat_locks[idle]
+
+    if chat_id not in chat_buckets:
+        chat_buckets[chat_id] = TokenBucket(chat_rate)
+        chat_locks[chat_id] = asyncio.Lock()
+    return chat_buckets[chat_id]
+
+
+async def _deliver(message: dict, future: asyncio.Future) -> None:
+    """Sends the message within the chat's limit, retrying when Telegram asks to slow down"""
+    chat_id = message["chat_id"]
+    bucket = _chat_bucket(chat_id)
+
+    async with chat_locks[chat_id]:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await asyncio.sleep(bucket.reserve())
+            try:
+                result = await bot.send_message(**message)
+            except RetryAfter as e:
+                logger.info("Flood limit hit sending to %s, retrying in %ss.", chat_id, e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                logger.exception(e)
+                if not future.done():
+                    future.set_exception(e)
+                return
+
+            if not future.done():
+                future.set_result(result)
+            return
+
+    logger.error("Gave up sending a message to %s after %s attempts.", chat_id, MAX_ATTEMPTS)
+    if not future.done():
+        future.set_exception(RetryAfter(0))
+
+
+async def run() -> None:
+    """Releases queued messages within the global limit until cancelled"""
+    while True:
+        priority, _, message, future = await queue.get()
+        await asyncio.sleep(global_bucket.reserve())
+
+        delivery = asyncio.create_task(_deliver(message, future))
+        deliveries.add(delivery)
+        delivery.add_done_callback(deliveries.discard)
+        delivery.add_done_callback(lambda _: queue.task_done())
+
+
+def start(shared_bot, configs: dict) -> None:
+    """Starts the worker on the running event loop, sending through the given bot"""
+    global bot, queue, global_bucket, chat_rate, dispatcher
+
+    bot = shared_bot
+    queue = asyncio.PriorityQueue()
+    global_bucket = TokenBucket(configs.get("global_rate") or DEFAULT_GLOBAL_RATE)
+    chat_rate = configs.get("chat_rate") or DEFAULT_CHAT_RATE
+    dispatcher = asyncio.create_task(run())
+
+
+async def stop() -> None:
+    """Sends what is left in the queue, giving up after STOP_TIMEOUT seconds"""
+    if not dispatcher:
+        return
+
+    try:
+        await asyncio.wait_for(queue.join(), timeout=STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error("Dropping %s unsent messages.", queue.qsize())
+
+    dispatcher.cancel()
+    for delivery in list(deliveries):
+        delivery.cancel()
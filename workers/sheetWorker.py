@@ -1,47 +1,82 @@
 """
 Worker class to handle creation of a new sheet every day.
 
+The next day's worksheet is built off-peak by duplicating a template holding the sorted roster, and switched to
+just after midnight without any requests to Google Sheets. Users approved or removed after it was built are then
+synced to it by the roster worker.
+
 Author: eliaise
 """
 
-import schedule
 import logging
+from datetime import date, time, timedelta
+
 import constants
-from connectors import ggsheets, db
+from connectors import ggsheets, db, ledger, snapshot
+from workers import scheduler, rosterWorker, flushWorker
 
-# Enable logging
-logging.basicConfig(
-    format=constants.LOG_FORMAT, level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
+DEFAULT_PROVISION_AT = time(22, 0)
+
+owner = True    # whether this process writes to the spreadsheet, only one webhook worker does
+
+
+def roster() -> list:
+    """Returns the rows of every approved user, sorted by department, title and name"""
+    result = db.run_select_sync(constants.SELECT_ROSTER, None)
+    if result is None:
+        raise RuntimeError("Failed to retrieve data for all users.")
+    return result
+
 
 def create_sheet(admin=None) -> None:
-    """Worker function to create a new sheet the following day"""
+    """Builds today's worksheet, or indexes it if it was created earlier today, and switches to it"""
     logger.info("Creating new worksheet")
-    result = ggsheets.create(admin)
-    if result == 0:
-        # spreadsheet was freshly created, fill up the spreadsheet with data of all users
-        # TODO: sort by title and department of user
-        stmt = constants.SELECT_ACTIVE_USERS
-        result = db.run_select(stmt, None)
-        if not result:
-            logger.error("Failed to retrieve data for all users.")
+    ggsheets.provision(date.today(), roster, admin)
+    ggsheets.activate()
+    if ggsheets.values is None:
+        # today's worksheet was not switched to from the one held ready, so its rows are read instead
+        logger.warning("Today's worksheet was not held ready, reading its rows.")
+        ggsheets.load(ggsheets.read())
+    snapshot.load(ggsheets.values)
 
-        ggsheets.append(result[1:])
-        ggsheets.values = result
 
-    ggsheets.append(result[1:])
-    ggsheets.values = result
+def provision_sheet(admin=None) -> None:
+    """Builds tomorrow's worksheet off-peak, ready for the switch at midnight"""
+    ggsheets.provision(date.today() + timedelta(days=1), roster, admin)
 
 
-def init(admin=None) -> None:
+def roll_over(admin=None) -> None:
+    """Switches to the worksheet built for the new day, building it now if that was not done ahead of time"""
+    ggsheets.rollover()
+    if ggsheets.values is None:
+        create_sheet(admin)
+    else:
+        snapshot.load(ggsheets.values)
+        # users approved or removed after the worksheet was built
+        rosterWorker.sync_all()
+
+    # statuses of the previous day which had not been written to its worksheet yet
+    try:
+        flushWorker.catch_up(date.today() - timedelta(days=1))
+    except Exception as e:
+        logger.exception(e)
+
+
+def refresh_snapshot() -> None:
+    """Reloads the attendance snapshot from the ledger, to pick up changes made by other webhook workers"""
+    rows = ledger.roster(date.today())
+    if rows is not None:
+        snapshot.load(rows)
+
+
+def init(admin=None, provision_at: time = DEFAULT_PROVISION_AT) -> None:
     """
     Scheduled task to create a new sheet every day.
     """
-    # attempt to create new sheet
-    create_sheet(admin)
-
-    # schedule next sheet creation
+    # switch to today's sheet on startup, building it if needed, and schedule subsequent sheet creation
     logger.info("Creating daily worker.")
-    schedule.every().day.at("04:00").do(lambda: create_sheet(admin))
+    scheduler.daily("provision_sheet", lambda: provision_sheet(admin), provision_at or DEFAULT_PROVISION_AT,
+                    catch_up=True)
+    scheduler.daily("roll_over", lambda: roll_over(admin), time(0, 0, 1), run_now=True)
@@ -0,0 +1,251 @@
+"""
+Worker class to compute attendance statistics over a range of days from the attendance ledger.
+
+The statuses of the days which are not cached yet are streamed from the ledger one chunk at a time, and held as a
+columnar table of (user id, status category) columns per day. Each day is then reduced to the number of users
+present, on leave and missing for every (department, title) in a single pass of C-level iterators: the two columns
+are mapped to group and category codes, combined into one key, and counted. Days which have ended are cached, so
+that later queries over overlapping ranges only read the days they have not seen yet.
+
+Users are counted as missing on a day if they were on its roster and gave no status. As the users table keeps no
+history, the roster of a day is the users approved at the time the day is first aggregated, who had given their first
+status on or before the day. Days on which no one gave a status, such as weekends, are left out. Statuses are counted
+as present or leave as the snapshot counts them for /pull, and the statuses of users who have since been deleted are
+reported under DELETED.
+
+Run from the repository root:
+    python -m workers.statsWorker 2026-01-01 2026-12-31 --department IT
+
+Author: eliaise
+"""
+
+import argparse
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from datetime import date, datetime, timedelta
+from itertools import repeat
+from operator import add, mul
+
+import config
+import logconfig
+from connectors import db, snapshot
+
+logger = logging.getLogger(__name__)
+
+PRESENT, LEAVE, MISSING = range(3)
+DELETED = "Deleted users"   # department of the statuses of users who no longer exist
+MAX_DAYS = 800          # days of aggregates kept
+CHUNK_SIZE = 10000      # ledger rows read at a time
+
+SELECT_USERS = "SELECT u.userId, u.department, u.title, u.accStatus, MIN(a.date) FROM users u " \
+               "LEFT JOIN attendance a ON a.userId = u.userId GROUP BY u.userId, u.department, u.title, u.accStatus"
+SELECT_STATUSES = "SELECT date, userId, status FROM attendance WHERE date BETWEEN %s AND %s AND status IS NOT NULL " \
+                  "AND status <> '' ORDER BY date"
+
+days = {}           # day -> {(department, title): (present, leave, missing)}, for days which have ended
+lock = threading.Lock()
+
+
+class Codes(dict):
+    """Numbers each new key in the order it is first looked up"""
+
+    def __missing__(self, key):
+        code = self[key] = len(self)
+        return code
+
+
+class Categories(dict):
+    """Maps each status to whether it counts as present or leave, as classified by the snapshot"""
+
+    codes = {snapshot.PRESENT: PRESENT, snapshot.LEAVE: LEAVE}
+
+    def __missing__(self, status):
+        category = self[status] = self.codes[snapshot.category(status)]
+        return category
+
+
+class Roster:
+    """The (department, title) group of every user, and the days on which the approved users of each group joined"""
+
+    def __init__(self, rows: list):
+        self.groups = Codes()                                   # (department, title) -> group code
+        self.group_of = {}                                      # userId -> group code
+        self.joined = {}                                        # group code -> sorted days of first statuses
+        for user_id, department, title, acc_status, first in rows:
+            code = self.groups[(department, title)]
+            self.group_of[user_id] = code
+            if acc_status == 1 and first is not None:
+                self.joined.setdefault(code, []).append(first if isinstance(first, date) else date.fromisoformat(first))
+        for joined in self.joined.values():
+            joined.sort()
+        self.unknown = self.groups[(DELETED, None)]             # users who have since been deleted
+
+    def size(self, code: int, day: date) -> int:
+        """Returns the number of users of the group on the roster of the day"""
+        return bisect_right(self.joined.get(code, ()), day)
+
+    def aggregate(self, day: date, user_ids: array, categories: array) -> dict:
+        """Reduces a day's columns to the (present, leave, missing) count of every group"""
+        group_of = self.group_of
+        groups = map(group_of.get, user_ids, repeat(self.unknown, len(user_ids)))
+        counts = Counter(map(add, map(mul, groups, repeat(2)), categories))
+
+        result = {}
+        for (department, title), code in self.groups.items():
+            present, leave = counts[code * 2 + PRESENT], counts[code * 2 + LEAVE]
+            missing = max(self.size(code, day) - present - leave, 0)
+            if present or leave or missing:
+                result[(department, title)] = (present, leave, missing)
+        return result
+
+
+def _load(start: date, end: date, roster: Roster) -> dict:
+    """Aggregates every day from start to end from the ledger, leaving out the days without any statuses"""
+    result = {}
+    categories = Categories()
+    current, user_ids, codes = None, array("q"), array("b")
+
+    def finish() -> None:
+        if current is not None:
+            result[current] = roster.aggregate(current, user_ids, codes)
+
+    for chunk in db.stream_sync(SELECT_STATUSES, (start.isoformat(), end.isoformat()), CHUNK_SIZE):
+        # the chunk is split into its columns, then cut where the day changes, as the rows are sorted by day
+        chunk_days, chunk_users, chunk_statuses = zip(*chunk)
+        offset = 0
+        while offset < len(chunk):
+            day = chunk_days[offset]
+            day = day if isinstance(day, date) else date.fromisoformat(day)
+            if day != current:
+                finish()
+                current, user_ids, codes = day, array("q"), array("b")
+            stop = bisect_right(chunk_days, chunk_days[offset], offset)
+            user_ids.extend(chunk_users[offset:stop])
+            codes.extend(map(categories.__getitem__, chunk_statuses[offset:stop]))
+            offset = stop
+    finish()
+    return result
+
+
+def aggregates(start: date, end: date) -> dict:
+    """Returns the aggregates of every day from start to end, reading only the days which are not cached"""
+    today = date.today()
+    end = min(end, today)
+    wanted = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+    with lock:
+        result = {day: days[day] for day in wanted if day in days}
+    missing = [day for day in wanted if day not in result]
+    if not missing:
+        return result
+
+    users = db.run_select_sync(SELECT_USERS, None)
+    if users is None:
+        raise RuntimeError("Failed to read the users.")
+
+    # the days not cached are read in runs of consecutive days
+    roster = Roster(users)
+    loaded = {}
+    first = previous = missing[0]
+    for day in missing[1:] + [None]:
+        if day is None or day - previous > timedelta(days=1):
+            loaded.update(_load(first, previous, roster))
+            first = day
+        previous = day
+    # days without any statuses are empty, and are cached too so that they are not read again
+    result.update((day, loaded.get(day, {})) for day in missing)
+    with lock:
+        for day in missing:
+            if day < today and day not in days:
+                days[day] = result[day]
+        while len(days) > MAX_DAYS:
+            del days[min(days)]
+    return result
+
+
+def report(start: date, end: date, department: str = None) -> dict:
+    """
+    Returns the (present, leave, missing) counts from start to end, of the department or of everyone.
+
+    totals: summed over every day
+    groups: by title for a department, or by department for everyone
+    trend: of each day on which anyone gave a status
+    """
+    totals = [0, 0, 0]
+    groups = {}
+    trend = []
+    for day, aggregate in sorted(aggregates(start, end).items()):
+        day_totals = [0, 0, 0]
+        for (group_department, title), counts in aggregate.items():
+            if department and group_department != department:
+                continue
+            key = title if department else group_department
+            group = groups.setdefault(key, [0, 0, 0])
+            for category in (PRESENT, LEAVE, MISSING):
+                group[category] += counts[category]
+                day_totals[category] += counts[category]
+        if not any(day_totals):
+            continue
+        trend.append((day, tuple(day_totals)))
+        for category in (PRESENT, LEAVE, MISSING):
+            totals[category] += day_totals[category]
+
+    return {
+        "start": start,
+        "end": min(end, date.today()),
+        "department": department,
+        "totals": tuple(totals),
+        "groups": {key: tuple(counts) for key, counts in groups.items()},
+        "trend": trend
+    }
+
+
+def rates(counts: tuple) -> str:
+    """Describes the counts as rates"""
+    total = sum(counts)
+    if not total:
+        return "no one on the roster"
+    return "{:.1%} present, {:.1%} leave, {:.1%} missing".format(*(count / total for count in counts))
+
+
+def summary(result: dict) -> list:
+    """Describes the report, one line at a time"""
+    lines = ["{}, {} to {}: {}".format(result["department"] or "All departments", result["start"], result["end"],
+                                       rates(result["totals"]))]
+    lines.append("By {}:".format("title" if result["department"] else "department"))
+    lines += ["{}: {}".format(key, rates(counts)) for key, counts in sorted(result["groups"].items(),
+                                                                           key=lambda item: str(item[0]))]
+    lines.append("Daily:")
+    lines += ["{:%d %b}: {}".format(day, rates(counts)) for day, counts in result["trend"]]
+    return lines
+
+
+def main() -> None:
+    """Prints the statistics of a date range from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("start", help="first day, e.g. 2026-01-01")
+    parser.add_argument("end", help="last day, e.g. 2026-12-31")
+    parser.add_argument("--department", help="only this department, by title")
+    args = parser.parse_args()
+
+    logconfig.setup()
+    configs = config.read()
+    logconfig.configure(configs)
+    db.connect(configs)
+
+    start = time.perf_counter()
+    result = report(datetime.strptime(args.start, "%Y-%m-%d").date(), datetime.strptime(args.end, "%Y-%m-%d").date(),
+                    args.department)
+    print("\n".join(summary(result)))
+    print("Computed in {:.2f}s.".format(time.perf_counter() - start))
+
+    db.close()
+    logconfig.stop()
+
+
+if __name__ == "__main__":
+    main()